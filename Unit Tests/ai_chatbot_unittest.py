@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+# config.py holds the deployment's secrets and isn't committed
+sys.modules.setdefault('config', types.SimpleNamespace(OPENAI_API_KEY='test-key', AI_CHATBOTID='ai-bot', PY_CHATBOTID='py-bot'))
+from ai_chatbot import AiBot
+from jobs import Scheduler
+from metrics import metrics
+
+class TestWebhookJobs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        self.bot = AiBot('test-key')
+        self.bot.scheduler = Scheduler('test.aibot.jobs', workers=1, maxsize=1)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.questions = []
+        self.bot.handle_text = self.answer
+        self.client = self.bot.app.test_client()
+
+    def tearDown(self):
+        self.release.set()
+        self.bot.scheduler.drain(5)
+        self.bot.persister.stop()   # its files are relative to the temporary directory
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def answer(self, text, conversation):
+        self.questions.append(text)
+        self.release.wait(5)
+
+    def post(self, text, message_id):
+        response = self.client.post('/', json={'id': message_id, 'group_id': 'g1', 'user_id': 'u1', 'text': text})
+        return response.status_code
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_webhook_returns_before_the_answer(self):
+        self.assertEqual(self.post('@ai what is a list', 'm1'), 200)
+        self.wait_until(lambda: self.questions)
+        self.assertEqual(self.questions, ['what is a list'])
+        self.assertEqual(self.bot.scheduler.lanes['gpt-3.5'].running, 1)     # still answering
+        self.release.set()
+        self.assertTrue(self.bot.scheduler.drain(5))
+        timings = metrics.snapshot()['timings']
+        self.assertEqual(timings['test.aibot.jobs.gpt-3.5.wait']['count'], timings['test.aibot.jobs.gpt-3.5.service']['count'])
+
+    def test_full_lane_returns_503_and_accepts_the_retry(self):
+        self.assertEqual(self.post('@ai first', 'm1'), 200)
+        self.wait_until(lambda: self.questions)
+        self.assertEqual(self.post('@ai second', 'm2'), 200)     # waits in the lane
+        self.assertEqual(self.post('@ai third', 'm3'), 503)
+        self.release.set()
+        self.assertTrue(self.bot.scheduler.drain(5))
+        self.assertEqual(self.post('@ai third', 'm3'), 200)     # GroupMe's retry of the same message
+        self.assertTrue(self.bot.scheduler.drain(5))
+        self.assertEqual(self.questions, ['first', 'second', 'third'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import types
+import unittest
+from unittest.mock import patch
+
+from aiohttp.test_utils import TestClient, TestServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+# config.py holds the deployment's secrets and isn't committed
+sys.modules.setdefault('config', types.SimpleNamespace(OPENAI_API_KEY='test-key', AI_CHATBOTID='ai-bot', PY_CHATBOTID='py-bot'))
+from ai_chatbot import AiBot
+from async_server import AsyncAiServer, AsyncOutbox
+from jobs import JOB_QUEUE_SIZE
+from metrics import metrics
+
+class Recorder:
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.sent = []
+        self.attempts = 0
+
+    async def __call__(self, text):
+        self.attempts += 1
+        status = self.statuses.pop(0) if self.statuses else 202
+        if status < 400:
+            self.sent.append(text)
+        return status
+
+@patch('delivery.DELIVERY_BACKOFF_BASE', 0)
+class TestAsyncOutbox(unittest.TestCase):
+    def run_outbox(self, send, messages):
+        async def run():
+            outbox = AsyncOutbox('test.async_outbox', send, asyncio.get_running_loop(), min_interval=0)
+            for group_id, text in messages:
+                outbox.enqueue(group_id, text)
+            return await outbox.drain()
+        return asyncio.run(run())
+
+    def test_delivers_each_group_in_order(self):
+        send = Recorder()
+        self.assertTrue(self.run_outbox(send, [(group, f'{group}{i}') for i in range(10) for group in 'ab']))
+        self.assertEqual([text for text in send.sent if text.startswith('a')], [f'a{i}' for i in range(10)])
+        self.assertEqual(len(send.sent), 20)
+
+    def test_retries_server_errors_but_not_client_errors(self):
+        send = Recorder([500, 429])
+        self.run_outbox(send, [('a', 'hello')])
+        self.assertEqual((send.sent, send.attempts), (['hello'], 3))
+        send = Recorder([400])
+        self.run_outbox(send, [('a', 'rejected')])
+        self.assertEqual((send.sent, send.attempts), ([], 1))
+
+    def test_enqueue_from_another_thread(self):
+        send = Recorder()
+        async def run():
+            outbox = AsyncOutbox('test.async_outbox', send, asyncio.get_running_loop(), min_interval=0)
+            thread = threading.Thread(target=outbox.enqueue, args=('a', 'from a thread'))
+            thread.start()
+            thread.join()
+            await asyncio.sleep(0)
+            return await outbox.drain()
+        self.assertTrue(asyncio.run(run()))
+        self.assertEqual(send.sent, ['from a thread'])
+
+class TestAsyncAiServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        self.bot = AiBot('test-key')
+        self.bot.preload = lambda: None     # no tokenizer or openai needed for routing
+        self.server = AsyncAiServer(self.bot)
+        self.sent = Recorder()
+        self.server.send_message = self.sent
+        self.questions = []
+        self.server.handle_text = self.record_question
+        self.client = TestClient(TestServer(self.server.app))
+        await self.client.start_server()
+        self.bot.outbox.min_interval = 0
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    async def record_question(self, lane, text, group_id, user_id):
+        self.questions.append((lane, text, group_id, user_id))
+
+    async def post(self, text, message_id, sender_type='user'):
+        response = await self.client.post('/', json={'id': message_id, 'group_id': 'g1', 'user_id': 'u1',
+                                                     'sender_type': sender_type, 'text': text})
+        return response.status
+
+    async def test_questions_are_routed_to_their_lane(self):
+        self.assertEqual(await self.post('@ai what is a list', 'm1'), 200)
+        self.assertEqual(await self.post('hello everyone', 'm2'), 200)
+        self.assertEqual(await self.post('@ai what is a list', 'm3', sender_type='bot'), 200)
+        await asyncio.gather(*self.server.tasks)
+        self.assertEqual(self.questions, [('gpt-3.5', 'what is a list', 'g1', 'u1')])
+
+    async def test_instant_commands_are_answered_off_the_loop(self):
+        self.assertEqual(await self.post('@ai !ping', 'm1'), 200)
+        await self.bot.outbox.drain()
+        self.assertEqual(self.sent.sent, ['AI Chat is up and running.'])
+
+    async def test_cold_start_ends_with_the_first_webhook(self):
+        self.assertFalse(self.bot.ready)
+        await self.post('hello everyone', 'm1')
+        self.assertTrue(self.bot.ready)
+        self.assertGreater(metrics.snapshot()['gauges']['aibot.cold_start'], 0)
+
+    async def test_full_lane_returns_503_and_accepts_the_retry(self):
+        self.server.waiting['gpt-3.5'] = JOB_QUEUE_SIZE
+        self.assertEqual(await self.post('@ai what is a list', 'm1'), 503)
+        self.server.waiting['gpt-3.5'] = 0
+        self.assertEqual(await self.post('@ai what is a list', 'm1'), 200)
+        await asyncio.gather(*self.server.tasks)
+        self.assertEqual(len(self.questions), 1)
+
+    async def test_lane_caps_calls_in_flight(self):
+        self.server.lanes['gpt-4'] = asyncio.Semaphore(1)
+        release = threading.Event()
+        running = []
+        def use_gpt4(text, conversation):
+            running.append(text)
+            release.wait(5)
+        self.bot.use_gpt4 = use_gpt4
+        for i in range(3):
+            await self.post(f'@ai use gpt4 question {i}', f'm{i}')
+        await asyncio.sleep(0.2)
+        self.assertEqual((len(running), self.server.waiting['gpt-4']), (1, 2))
+        release.set()
+        await asyncio.gather(*self.server.tasks)
+        self.assertEqual(len(running), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from budget import (MessageTooLongError, PromptBudgeter, SUMMARIZED_PROMPT_TOKEN_TARGET, TOKENS_PER_MESSAGE,
+                    TOKENS_PER_REPLY, TYPICAL_QUESTION_TOKENS, context_window)
+from conversation import Conversation
+from persistence import JsonFileBackend
+
+class WordTokenizer:
+    def encode(self, text):
+        return text.split()
+
+def history(*texts):
+    return [{'role': 'user', 'content': text, 'tokens': len(text.split())} for text in texts]
+
+class TestPromptBudgeter(unittest.TestCase):
+    def test_context_window_prefers_longest_prefix(self):
+        self.assertEqual(context_window('gpt-4-0613'), 8192)
+        self.assertEqual(context_window('gpt-4-32k-0613'), 32768)
+        self.assertEqual(context_window('gpt-3.5-turbo-16k'), 16384)
+
+    def test_prompt_count_includes_framing(self):
+        budgeter = PromptBudgeter(WordTokenizer(), 'be brief')
+        messages, used = budgeter.build_messages(history('a b c'), 'gpt-3.5-turbo', 500)
+        self.assertEqual(messages, [{'role': 'system', 'content': 'be brief'}, {'role': 'user', 'content': 'a b c'}])
+        self.assertEqual(used, (TOKENS_PER_MESSAGE + 1 + 2) + (TOKENS_PER_MESSAGE + 1 + 3) + TOKENS_PER_REPLY)
+        self.assertEqual(used, budgeter.count_messages(messages))
+
+    def test_newest_messages_fill_the_target(self):
+        budgeter = PromptBudgeter(WordTokenizer(), 'be brief', prompt_token_target=30)
+        messages, used = budgeter.build_messages(history('one', 'two words', 'three more words', 'four'), 'gpt-4', 500)
+        self.assertEqual([m['content'] for m in messages[1:]], ['two words', 'three more words', 'four'])
+        self.assertLessEqual(used, 30)
+
+    def test_newest_message_is_sent_past_the_target(self):
+        budgeter = PromptBudgeter(WordTokenizer(), 'be brief', prompt_token_target=30)
+        question = ' '.join(['word'] * 100)
+        summary = {'content': 'earlier', 'tokens': 1}
+        messages, used = budgeter.build_messages(history('older', question), 'gpt-3.5-turbo', 500, summary)
+        self.assertEqual(messages, [{'role': 'system', 'content': 'be brief'}, {'role': 'user', 'content': question}])
+        self.assertEqual(used, budgeter.count_messages(messages))
+
+    def test_message_over_the_context_window_is_rejected(self):
+        budgeter = PromptBudgeter(WordTokenizer(), 'be brief')
+        with self.assertRaises(MessageTooLongError):
+            budgeter.build_messages(history(' '.join(['word'] * 4000)), 'gpt-3.5-turbo', 500)
+
+    def test_history_limits_keep_the_whole_window_in_the_prompt(self):
+        budgeter = PromptBudgeter(WordTokenizer(), 'be brief', prompt_token_target=600)
+        limit, overhead = budgeter.history_limits('gpt-3.5-turbo', 50, summary_tokens=10)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        conversation = Conversation(WordTokenizer(), JsonFileBackend(os.path.join(tmpdir.name, 'conversation.json')),
+                                    history_limits=lambda: (limit, overhead))
+        for i in range(200):
+            conversation.add_message_to_history('user', 'one two three')
+        summary = {'content': ' '.join(['word'] * 10), 'tokens': 10}
+        messages, used = budgeter.build_messages(conversation.snapshot(), 'gpt-3.5-turbo', 50, summary)
+        self.assertEqual(len(messages), 2 + len(conversation.conversation_history))
+        self.assertLessEqual(used, 600)
+
+    def test_window_holds_a_question_and_its_answer(self):
+        budgeter = PromptBudgeter(WordTokenizer(), ' '.join(['word'] * 40), SUMMARIZED_PROMPT_TOKEN_TARGET)
+        limit, overhead = budgeter.history_limits('gpt-3.5-turbo', 500, summary_tokens=310)
+        self.assertGreaterEqual(limit, TYPICAL_QUESTION_TOKENS + 500 + 2 * overhead)
+        small = PromptBudgeter(WordTokenizer(), 'be brief', prompt_token_target=100)
+        self.assertEqual(small.history_limits('gpt-3.5-turbo', 500)[0], TYPICAL_QUESTION_TOKENS + 500 + 2 * overhead)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from cache import ResponseCache
+
+class TestResponseCache(unittest.TestCase):
+    def test_key_ignores_case_whitespace_and_trailing_punctuation(self):
+        cache = ResponseCache('test.cache', path=None)
+        self.assertEqual(cache.key('gpt', 'What is a list?'), cache.key('gpt', '  what is  a LIST '))
+        self.assertNotEqual(cache.key('gpt', 'What is a list?'), cache.key('gpt-4', 'What is a list?'))
+        self.assertNotEqual(cache.key('gpt', 'why', ['answer one']), cache.key('gpt', 'why', ['answer two']))
+
+    def test_entries_expire(self):
+        cache = ResponseCache('test.cache', ttl=10, path=None)
+        with patch('cache.time.time', return_value=1000):
+            cache.put('k', ['answer', 'gpt'])
+            self.assertEqual(cache.get('k'), ['answer', 'gpt'])
+        with patch('cache.time.time', return_value=1011):
+            self.assertIsNone(cache.get('k'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResponseCache('test.cache', max_entries=2, path=None)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_entries_survive_restart(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'cache.json')
+            ResponseCache('test.cache', path=path).put('k', ['answer', 'gpt'])
+            self.assertEqual(ResponseCache('test.cache', path=path).get('k'), ['answer', 'gpt'])
+
+if __name__ == "__main__":
+    unittest.main()
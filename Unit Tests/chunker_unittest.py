@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from chunker import find_markers, split_message, utf16_len
+
+CODE_ANSWER = (
+    'Here is how you can reverse a list in Python. There are a few ways to do it. ' * 5 + '\n' +
+    '-'*25 + '\n' +
+    'def reverse(items):\n    result = []\n    for item in reversed(items):\n        result.append(item)\n    return result\n' +
+    '-'*25 + '\n' +
+    'The slice syntax items[::-1] does the same thing in one line. ' * 4
+)
+
+class TestSplitMessage(unittest.TestCase):
+    def test_short_message_is_one_chunk(self):
+        self.assertEqual(split_message('hello world'), ['hello world'])
+        self.assertEqual(split_message(''), [])
+
+    def test_chunks_fit_the_limit(self):
+        text = ' '.join(f'word{i}' for i in range(2000))
+        chunks = split_message(text, 100)
+        self.assertTrue(all(utf16_len(chunk) <= 100 for chunk in chunks))
+        self.assertEqual(' '.join(chunks), text)
+
+    def test_prefers_sentence_ends(self):
+        text = 'This is a sentence. ' * 40
+        chunks = split_message(text, 100)
+        self.assertTrue(all(chunk.endswith('.') for chunk in chunks))
+
+    def test_keeps_code_block_together(self):
+        chunks = split_message(CODE_ANSWER, 449)
+        code_chunks = [chunk for chunk in chunks if 'def reverse' in chunk]
+        self.assertEqual(len(code_chunks), 1)
+        self.assertIn('    return result', code_chunks[0])
+        self.assertTrue(code_chunks[0].startswith('-'*25))
+
+    def test_splits_on_lines_not_mid_line(self):
+        text = '\n'.join(f'    print({i} * {i})' for i in range(100))
+        chunks = split_message(text, 120)
+        for chunk in chunks:
+            for line in chunk.split('\n'):
+                self.assertRegex(line, r'^\s*print\(\d+ \* \d+\)$')
+
+    def test_counts_utf16_units(self):
+        text = '\U0001F600' * 300    # each emoji is two UTF-16 units
+        chunks = split_message(text, 449)
+        self.assertTrue(all(utf16_len(chunk) <= 449 for chunk in chunks))
+        self.assertEqual(''.join(chunks), text)
+
+    def test_markers_start_a_line(self):
+        text = 'see ``` here\n```python\ncode\n' + 'x ' + '-'*25 + '\n' + '-'*30 + '\n```'
+        self.assertEqual([text[start:end] for start, end in find_markers(text, 0, len(text))],
+                         ['```python\n', '-'*30 + '\n'])
+
+    def test_hard_cut_without_boundaries(self):
+        chunks = split_message('x' * 1000, 449)
+        self.assertEqual([len(chunk) for chunk in chunks], [449, 449, 102])
+
+if __name__ == '__main__':
+    unittest.main()
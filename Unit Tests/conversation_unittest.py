@@ -0,0 +1,167 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from conversation import Conversation, ConversationStore
+from persistence import JournalBackend, JsonFileBackend, WriteBehindPersister
+from summary import SUMMARY_PREFIX, Summarizer
+
+class WordTokenizer:
+    def encode(self, text):
+        return text.split()
+
+class TestConversation(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'conversation.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_running_total_matches_recount(self):
+        conversation = Conversation(WordTokenizer(), JsonFileBackend(self.path))
+        conversation.history_token_limit = 10
+        for i in range(20):
+            conversation.add_message_to_history('user', 'one two three')
+        self.assertEqual(conversation.count_tokens(), conversation.recount_tokens())
+        self.assertLessEqual(conversation.count_tokens(), 10)
+        self.assertEqual(len(conversation.conversation_history), 3)
+
+    def test_newest_message_is_never_evicted(self):
+        evicted = []
+        conversation = Conversation(WordTokenizer(), JsonFileBackend(self.path),
+                                    on_evict=lambda conversation, messages, generation: evicted.extend(messages))
+        conversation.history_token_limit = 5
+        conversation.add_message_to_history('user', 'short')
+        conversation.add_message_to_history('user', 'a question longer than the whole window')
+        self.assertEqual(conversation.last_content('user'), 'a question longer than the whole window')
+        self.assertEqual([m['content'] for m in evicted], ['short'])
+
+    def test_reload_keeps_token_counts(self):
+        conversation = Conversation(WordTokenizer(), JsonFileBackend(self.path))
+        conversation.add_message_to_history('user', 'hello there')
+        conversation.add_message_to_history('assistant', 'hi')
+        reloaded = Conversation(WordTokenizer(), JsonFileBackend(self.path))
+        self.assertEqual(reloaded.count_tokens(), 3)
+        self.assertEqual(reloaded.messages(), conversation.messages())
+
+    def test_clear(self):
+        conversation = Conversation(WordTokenizer(), JsonFileBackend(self.path))
+        conversation.add_message_to_history('user', 'hello there')
+        conversation.clear()
+        self.assertEqual(conversation.count_tokens(), 0)
+        self.assertEqual(Conversation(WordTokenizer(), JsonFileBackend(self.path)).messages(), [])
+
+class TestConversationStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_conversations_are_partitioned(self):
+        store = ConversationStore(WordTokenizer(), self.tmpdir.name)
+        store.get('g1', 'u1').add_message_to_history('user', 'first group')
+        store.get('g2', 'u1').add_message_to_history('user', 'second group')
+        self.assertEqual(store.get('g1', 'u1').messages(), [{'role': 'user', 'content': 'first group'}])
+        self.assertEqual(store.get('g2', 'u1').messages(), [{'role': 'user', 'content': 'second group'}])
+
+    def test_idle_conversations_are_evicted_and_reloaded(self):
+        store = ConversationStore(WordTokenizer(), self.tmpdir.name, max_conversations=2)
+        store.get('g1', 'u1').add_message_to_history('user', 'remember me')
+        store.get('g1', 'u2')
+        store.get('g1', 'u3')
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get('g1', 'u1').messages(), [{'role': 'user', 'content': 'remember me'}])
+
+    def test_held_conversations_are_not_evicted(self):
+        store = ConversationStore(WordTokenizer(), self.tmpdir.name, max_conversations=1)
+        held = store.get('g1', 'u1', hold=True)
+        store.get('g1', 'u2')
+        self.assertIs(store.get('g1', 'u1'), held)
+        held.release()
+        store.get('g1', 'u2')
+        self.assertEqual(list(store.conversations), [('g1', 'u2')])
+
+    def test_evicted_conversation_leaves_the_persister(self):
+        persister = WriteBehindPersister('test.store_persister', interval=60)
+        store = ConversationStore(WordTokenizer(), self.tmpdir.name, max_conversations=1, persister=persister)
+        first = store.get('g1', 'u1')
+        first.add_message_to_history('user', 'remember me')
+        store.get('g1', 'u2')
+        self.assertNotIn(first, persister.dirty)
+        self.assertIsNone(first.backend.file)
+        first.flush()
+        self.assertIsNone(first.backend.file)
+        self.assertEqual(store.get('g1', 'u1').messages(), [{'role': 'user', 'content': 'remember me'}])
+
+    def test_reload_waits_for_the_evicted_copy_to_close(self):
+        store = ConversationStore(WordTokenizer(), self.tmpdir.name, max_conversations=1)
+        first = store.get('g1', 'u1')
+        first.add_message_to_history('user', 'remember me')
+        closing = threading.Event()
+        release = threading.Event()
+        close = first.close
+        def slow_close():
+            closing.set()
+            release.wait(5)
+            close()
+        first.close = slow_close
+        evicting = threading.Thread(target=store.get, args=('g1', 'u2'))
+        evicting.start()
+        closing.wait(5)
+        reloaded = []
+        reloading = threading.Thread(target=lambda: reloaded.append(store.get('g1', 'u1')))
+        reloading.start()
+        reloading.join(0.1)
+        self.assertEqual(reloaded, [])
+        release.set()
+        for thread in (evicting, reloading):
+            thread.join(5)
+        self.assertIsNot(reloaded[0], first)
+        self.assertEqual(reloaded[0].messages(), [{'role': 'user', 'content': 'remember me'}])
+
+class TestRollingSummary(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'conversation.jsonl')
+        self.prompts = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def complete(self, messages, max_tokens=None):
+        self.prompts.append(messages[-1]['content'])
+        return {'choices': [{'message': {'content': f'summary {len(self.prompts)}'}}]}
+
+    def wait_for_summary(self, conversation):
+        deadline = time.time() + 5
+        while conversation.summary is None and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_evicted_messages_are_summarized_and_persisted(self):
+        summarizer = Summarizer(self.complete)
+        conversation = Conversation(WordTokenizer(), JournalBackend(self.path), on_evict=summarizer.submit)
+        conversation.history_token_limit = 4
+        for text in ['a b', 'c d', 'e f']:
+            conversation.add_message_to_history('user', text)
+        self.wait_for_summary(conversation)
+        self.assertEqual(conversation.summary['content'], SUMMARY_PREFIX + 'summary 1')
+        self.assertIn('user: a b', self.prompts[0])
+        conversation.close()
+        reloaded = Conversation(WordTokenizer(), JournalBackend(self.path))
+        self.assertEqual(reloaded.summary, conversation.summary)
+
+    def test_clear_discards_late_summary(self):
+        conversation = Conversation(WordTokenizer(), JournalBackend(self.path))
+        generation = conversation.generation
+        conversation.clear()
+        conversation.set_summary('stale', generation)
+        self.assertIsNone(conversation.summary)
+
+if __name__ == "__main__":
+    unittest.main()
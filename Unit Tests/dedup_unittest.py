@@ -0,0 +1,51 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from dedup import SeenSet, accept_webhook
+
+class TestSeenSet(unittest.TestCase):
+    def test_second_add_is_rejected(self):
+        seen = SeenSet('test.seen')
+        self.assertTrue(seen.add('m1'))
+        self.assertFalse(seen.add('m1'))
+        self.assertTrue(seen.add('m2'))
+
+    def test_entries_expire(self):
+        seen = SeenSet('test.seen', ttl=10)
+        with patch('dedup.time.monotonic', return_value=100.0):
+            seen.add('m1')
+        with patch('dedup.time.monotonic', return_value=111.0):
+            self.assertTrue(seen.add('m1'))
+
+    def test_size_is_bounded(self):
+        seen = SeenSet('test.seen', max_entries=3)
+        for i in range(10):
+            seen.add(f'm{i}')
+        self.assertEqual(len(seen.entries), 3)
+        self.assertTrue(seen.add('m0'))
+
+    def test_discard_lets_a_retry_through(self):
+        seen = SeenSet('test.seen')
+        seen.add('m1')
+        seen.discard('m1')
+        self.assertTrue(seen.add('m1'))
+
+class TestAcceptWebhook(unittest.TestCase):
+    def test_drops_bot_posts_and_redeliveries(self):
+        seen = SeenSet('test.seen')
+        message = {'id': 'm1', 'sender_type': 'user', 'user_id': 'u1', 'text': '@py print(1)'}
+        self.assertTrue(accept_webhook(message, seen))
+        self.assertFalse(accept_webhook(dict(message), seen))
+        self.assertFalse(accept_webhook({'id': 'm2', 'sender_type': 'bot', 'text': '@py print(1)'}, seen))
+
+    def test_payload_without_id_is_accepted(self):
+        seen = SeenSet('test.seen')
+        message = {'sender_type': 'user', 'user_id': 'u1', 'text': 'hi'}
+        self.assertTrue(accept_webhook(message, seen))
+        self.assertTrue(accept_webhook(message, seen))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from delivery import DelayedNotice, Outbox
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class Recorder:
+    def __init__(self, statuses=()):
+        self.lock = threading.Lock()
+        self.statuses = list(statuses)
+        self.sent = []
+
+    def __call__(self, text):
+        with self.lock:
+            status = self.statuses.pop(0) if self.statuses else 202
+            if isinstance(status, Exception):
+                raise status
+            if status < 400:
+                self.sent.append(text)
+            return Response(status)
+
+@patch('delivery.time.sleep')
+class TestOutbox(unittest.TestCase):
+    def test_delivers_each_group_in_order(self, sleep):
+        send = Recorder()
+        outbox = Outbox('test.outbox', send, min_interval=0)
+        for i in range(20):
+            outbox.enqueue('a', f'a{i}')
+            outbox.enqueue('b', f'b{i}')
+        self.assertTrue(outbox.drain())
+        self.assertEqual([text for text in send.sent if text.startswith('a')], [f'a{i}' for i in range(20)])
+        self.assertEqual([text for text in send.sent if text.startswith('b')], [f'b{i}' for i in range(20)])
+
+    def test_retries_rate_limits_and_server_errors(self, sleep):
+        send = Recorder([429, 503, requests.ConnectionError()])
+        outbox = Outbox('test.outbox', send, min_interval=0)
+        outbox.enqueue('a', 'hello')
+        outbox.enqueue('a', 'world')
+        self.assertTrue(outbox.drain())
+        self.assertEqual(send.sent, ['hello', 'world'])
+
+    def test_gives_up_on_client_errors(self, sleep):
+        send = Recorder([400])
+        outbox = Outbox('test.outbox', send, min_interval=0)
+        outbox.enqueue('a', 'bad')
+        outbox.enqueue('a', 'good')
+        self.assertTrue(outbox.drain())
+        self.assertEqual(send.sent, ['good'])
+
+    def test_drops_when_full(self, sleep):
+        blocked = threading.Event()
+        outbox = Outbox('test.outbox', lambda text: blocked.wait() and Response(202), min_interval=0, maxsize=2)
+        results = [outbox.enqueue('a', str(i)) for i in range(5)]
+        self.assertIn(False, results)
+        blocked.set()
+        self.assertTrue(outbox.drain())
+
+    def test_sender_exits_when_idle(self, sleep):
+        outbox = Outbox('test.outbox', Recorder(), min_interval=0, idle_timeout=0.05)
+        outbox.enqueue('a', 'hello')
+        sender = outbox.senders['a']
+        sender.join(1)
+        self.assertFalse(sender.is_alive())
+        self.assertEqual(outbox.senders, {})
+        self.assertTrue(outbox.enqueue('a', 'again'))
+        self.assertTrue(outbox.drain())
+
+class TestDelayedNotice(unittest.TestCase):
+    def test_fast_work_suppresses_notice(self):
+        posted = []
+        with DelayedNotice('test.notice', lambda: posted.append('thinking'), 0.2) as notice:
+            pass
+        notice.timer.join(1)
+        self.assertEqual(posted, [])
+
+    def test_slow_work_posts_notice_once(self):
+        posted = []
+        with DelayedNotice('test.notice', lambda: posted.append('thinking'), 0.01) as notice:
+            notice.timer.join(1)
+        notice.fire()
+        self.assertEqual(posted, ['thinking'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+# config.py holds the deployment's secrets and isn't committed
+sys.modules.setdefault('config', types.SimpleNamespace(OPENAI_API_KEY='test-key', AI_CHATBOTID='ai-bot', PY_CHATBOTID='py-bot'))
+import config
+from ai_chatbot import AiBot
+from gateway import Gateway
+from py_chatbot import PyBot
+from storage import SqliteStore
+
+class WordTokenizer:
+    def encode(self, text):
+        return text.split()
+
+class RecordingBot:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.ready = False
+
+    def webhook(self):
+        self.calls += 1
+        return self.name, 200
+
+    def mark_ready(self):
+        self.ready = True
+
+class TestGateway(unittest.TestCase):
+    def setUp(self):
+        self.ai_bot = RecordingBot('ai')
+        self.py_bot = RecordingBot('py')
+        self.client = Gateway(self.ai_bot, self.py_bot).app.test_client()
+
+    def post(self, payload, bot_id=None, **kwargs):
+        query = {'bot_id': bot_id} if bot_id else None
+        return self.client.post('/', query_string=query, json=payload, **kwargs)
+
+    def test_bot_id_picks_the_bot(self):
+        response = self.post({'text': '@ai what is a list'}, bot_id=config.PY_CHATBOTID)
+        self.assertEqual(response.get_data(as_text=True), 'py')
+        self.assertEqual((self.ai_bot.calls, self.py_bot.calls), (0, 1))
+
+    def test_mention_picks_the_bot(self):
+        self.assertEqual(self.post({'text': ' @ai what is a list'}).get_data(as_text=True), 'ai')
+        self.assertEqual(self.post({'text': '@py print(1)'}).get_data(as_text=True), 'py')
+        self.assertEqual((self.ai_bot.calls, self.py_bot.calls), (1, 1))
+
+    def test_other_messages_are_ignored(self):
+        self.assertEqual(self.post({'text': 'hello everyone'}).status_code, 200)
+        self.assertEqual((self.ai_bot.calls, self.py_bot.calls), (0, 0))
+
+    def test_payloads_without_text_are_ignored(self):
+        self.assertEqual(self.post({'sender_type': 'system', 'attachments': []}).status_code, 200)
+        self.assertEqual(self.post({'text': None}).status_code, 200)
+        self.assertEqual(self.post(None, data='not json', content_type='text/plain').status_code, 200)
+        self.assertEqual((self.ai_bot.calls, self.py_bot.calls), (0, 0))
+        self.assertTrue(self.ai_bot.ready)
+
+class TestWhyAcrossBots(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        storage = SqliteStore()
+        self.py_bot = PyBot(config.PY_CHATBOTID, storage=storage)
+        self.ai_bot = AiBot('test-key', storage=storage)
+        self.ai_bot.tokenizer = self.ai_bot.budgeter.tokenizer = self.ai_bot.conversations.tokenizer = WordTokenizer()
+        self.posts = []
+        self.py_bot.post_message = lambda text, group_id=None: None
+        self.ai_bot.post_message = lambda text, group_id=None: self.posts.append(text)
+        self.prompts = []
+        self.ai_bot.get_response_text = self.answer
+
+    def tearDown(self):
+        self.ai_bot.persister.stop()    # its files are relative to the temporary directory
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def answer(self, messages, gptmodel='gpt-3.5-turbo', group_id=None):
+        self.prompts.append(messages)
+        return 'You divided by zero.', gptmodel
+
+    def why(self, group_id, user_id):
+        self.ai_bot.why(self.ai_bot.conversations.get(group_id, user_id))
+
+    def test_why_explains_a_pybot_failure(self):
+        self.py_bot.handle_python_command('1/0', 'g1', 'u1')
+        self.why('g1', 'u1')
+        self.assertEqual(self.posts, ['You divided by zero.'])
+        self.assertEqual(self.prompts[0][1]['content'], '1/0')
+        self.assertIn('ZeroDivisionError', self.prompts[0][2]['content'])
+
+    def test_why_finds_failures_without_a_group(self):
+        self.py_bot.handle_python_command('1/0', None, 'u1')
+        self.why(None, 'u1')
+        self.assertEqual(self.posts, ['You divided by zero.'])
+
+    def test_why_is_scoped_to_the_user(self):
+        self.py_bot.handle_python_command('1/0', 'g1', 'u1')
+        self.why('g1', 'u2')
+        self.assertEqual(self.posts, ['The last message was not an error.'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import contextvars
+import os
+import sys
+import types
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+import http_clients
+
+def fake_openai():
+    return types.SimpleNamespace(requestssession=None, aiosession=contextvars.ContextVar('aiohttp-session', default=None))
+
+@patch.dict(http_clients.sessions, clear=True)
+class TestSessions(unittest.TestCase):
+    def test_use_for_openai_installs_the_shared_sessions(self):
+        openai = fake_openai()
+        aiosession = object()
+        http_clients.use_for_openai(openai, aiosession)
+        self.assertIs(openai.requestssession(), http_clients.session('openai'))
+        self.assertIs(openai.requestssession(), openai.requestssession())
+        self.assertIs(openai.aiosession.get(), aiosession)
+
+    def test_threaded_callers_leave_the_aiohttp_session_alone(self):
+        openai = fake_openai()
+        http_clients.use_for_openai(openai)
+        self.assertIsNone(openai.aiosession.get())
+
+    @patch('http_clients.HTTP_POOL_MAXSIZE', 3)
+    @patch('http_clients.HTTP_POOL_CONNECTIONS', 2)
+    def test_pool_sizes_come_from_configuration(self):
+        adapter = http_clients.session('groupme').get_adapter('https://api.groupme.com')
+        self.assertEqual((adapter._pool_connections, adapter._pool_maxsize), (2, 3))
+        self.assertIs(http_clients.session('groupme').get_adapter('http://example.com'), adapter)
+
+    def test_close_keeps_the_pool_for_every_bot(self):
+        openai = fake_openai()
+        http_clients.use_for_openai(openai)
+        groupme = http_clients.groupme()
+        openai_session = openai.requestssession()
+        self.assertIsNot(groupme, openai_session)
+        poolmanager = openai_session.get_adapter('https://api.openai.com').poolmanager
+        poolmanager.connection_from_url('https://api.openai.com')
+        openai_session.close()      # what openai 0.27 does to its per-thread session every 180 seconds
+        self.assertEqual(len(poolmanager.pools), 1)
+        self.assertIs(openai.requestssession(), openai_session)
+        self.assertIs(http_clients.groupme(), groupme)
+        self.assertEqual(len(http_clients.sessions), 2)
+
+    def test_forked_worker_gets_its_own_sessions(self):
+        groupme = http_clients.groupme()
+        with patch('http_clients.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(http_clients.groupme(), groupme)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from jobs import Scheduler
+
+LANES = {
+    'fast': {'weight': 2, 'concurrency': 4},
+    'slow': {'weight': 1, 'concurrency': 4},
+}
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.lock = threading.Lock()
+        self.order = []
+        self.running = 0
+        self.peak = 0
+
+    def record(self, name):
+        with self.lock:
+            self.order.append(name)
+
+    def block(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        self.release.wait(5)
+        with self.lock:
+            self.running -= 1
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_lanes_share_workers_by_weight(self):
+        scheduler = Scheduler('test.jobs', LANES, workers=1)
+        scheduler.submit('fast', self.block)
+        self.wait_until(lambda: self.running)
+        for i in range(6):
+            scheduler.submit('fast', self.record, 'fast')
+        for i in range(3):
+            scheduler.submit('slow', self.record, 'slow')
+        self.release.set()
+        self.assertTrue(scheduler.drain(5))
+        self.assertEqual(self.order, ['fast', 'slow', 'fast'] * 3)
+
+    def test_concurrency_is_capped_per_lane(self):
+        lanes = {'capped': {'weight': 1, 'concurrency': 2}, 'other': {'weight': 1, 'concurrency': 2}}
+        scheduler = Scheduler('test.jobs', lanes, workers=4)
+        for i in range(4):
+            scheduler.submit('capped', self.block)
+        scheduler.submit('other', self.record, 'other')
+        self.wait_until(lambda: self.order and self.running == 2)
+        self.assertEqual((self.running, self.order, len(scheduler.lanes['capped'].jobs)), (2, ['other'], 2))
+        self.release.set()
+        self.assertTrue(scheduler.drain(5))
+        self.assertEqual(self.peak, 2)
+
+    def test_full_lane_rejects_jobs(self):
+        scheduler = Scheduler('test.jobs', LANES, workers=1, maxsize=2)
+        scheduler.submit('fast', self.block)
+        self.wait_until(lambda: self.running)
+        self.assertTrue(scheduler.submit('fast', self.record, 'fast'))
+        self.assertTrue(scheduler.submit('fast', self.record, 'fast'))
+        self.assertFalse(scheduler.submit('fast', self.record, 'fast'))
+        self.assertTrue(scheduler.submit('slow', self.record, 'slow'))
+
+    def test_drain_waits_for_queued_and_running_jobs(self):
+        scheduler = Scheduler('test.jobs', LANES, workers=2)
+        scheduler.submit('fast', self.block)
+        scheduler.submit('slow', self.record, 'slow')
+        self.wait_until(lambda: self.running)
+        self.assertFalse(scheduler.drain(0.05))
+        self.release.set()
+        self.assertTrue(scheduler.drain(5))
+        self.assertEqual((self.order, self.running), (['slow'], 0))
+
+    @patch('jobs.traceback.print_exc')
+    def test_failing_job_does_not_stop_its_worker(self, print_exc):
+        scheduler = Scheduler('test.jobs', LANES, workers=1)
+        scheduler.submit('fast', lambda: 1 / 0)
+        scheduler.submit('fast', self.record, 'after')
+        self.assertTrue(scheduler.drain(5))
+        self.assertEqual(self.order, ['after'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from conversation import Conversation
+from persistence import JournalBackend, JsonFileBackend, WriteBehindPersister
+
+class WordTokenizer:
+    def encode(self, text):
+        return text.split()
+
+class TestJournalBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'conversation.jsonl')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def open_conversation(self, **kwargs):
+        conversation = Conversation(WordTokenizer(), JournalBackend(self.path, **kwargs))
+        conversation.history_token_limit = 6
+        return conversation
+
+    def test_replay_rebuilds_state(self):
+        conversation = self.open_conversation()
+        for word in ['a b', 'c d', 'e f', 'g h']:
+            conversation.add_message_to_history('user', word)
+        conversation.close()
+        reloaded = self.open_conversation()
+        self.assertEqual(reloaded.messages(), conversation.messages())
+        self.assertEqual(reloaded.count_tokens(), 6)
+
+    def test_clear_is_replayed(self):
+        conversation = self.open_conversation()
+        conversation.add_message_to_history('user', 'a b')
+        conversation.clear()
+        conversation.add_message_to_history('user', 'c')
+        conversation.close()
+        self.assertEqual(self.open_conversation().messages(), [{'role': 'user', 'content': 'c'}])
+
+    def test_torn_tail_is_dropped(self):
+        conversation = self.open_conversation()
+        conversation.add_message_to_history('user', 'a b')
+        conversation.close()
+        with open(self.path, 'ab') as file:
+            file.write(b'{"op": "add", "role": "us')
+        reloaded = self.open_conversation()
+        self.assertEqual(reloaded.messages(), [{'role': 'user', 'content': 'a b'}])
+        reloaded.add_message_to_history('user', 'c')
+        reloaded.close()
+        self.assertEqual(len(self.open_conversation().messages()), 2)
+
+    def test_compaction_keeps_live_messages(self):
+        conversation = self.open_conversation(compact_threshold=8)
+        for i in range(50):
+            conversation.add_message_to_history('user', f'word{i} x')
+        deadline = time.time() + 5
+        while conversation.backend.compacting and time.time() < deadline:
+            time.sleep(0.01)
+        conversation.backend.compact()
+        conversation.close()
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read().count(b'\n'), len(conversation.messages()))
+        self.assertEqual(self.open_conversation().messages(), conversation.messages())
+
+    def test_closed_backend_never_compacts(self):
+        conversation = self.open_conversation(compact_threshold=8)
+        for i in range(50):
+            conversation.add_message_to_history('user', f'word{i} x')
+        compactor = conversation.backend.compactor
+        conversation.close()
+        self.assertFalse(compactor.is_alive())      # close waits for a running compaction
+        conversation.backend.commit(conversation)
+        self.assertIs(conversation.backend.compactor, compactor)
+        self.assertEqual(os.listdir(self.tmpdir.name), ['conversation.jsonl'])
+        self.assertEqual(self.open_conversation().messages(), conversation.messages())
+
+class TestWriteBehindPersister(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'conversation.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_writes_are_coalesced(self):
+        persister = WriteBehindPersister('test.persister', interval=60)
+        conversation = Conversation(WordTokenizer(), JsonFileBackend(self.path), persister)
+        for i in range(5):
+            conversation.add_message_to_history('user', f'message {i}')
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(persister.queue_depth(), 1)
+        self.assertGreaterEqual(persister.flush_lag(), 0.0)
+        persister.stop()
+        self.assertEqual(persister.queue_depth(), 0)
+        self.assertEqual(len(Conversation(WordTokenizer(), JsonFileBackend(self.path)).messages()), 5)
+
+    def test_threshold_triggers_flush(self):
+        flushed = []
+        persister = WriteBehindPersister('test.persister', interval=60, max_dirty=2)
+        persister.mark_dirty('a', lambda: flushed.append('a'))
+        persister.mark_dirty('b', lambda: flushed.append('b'))
+        deadline = time.time() + 5
+        while len(flushed) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        persister.stop()
+        self.assertEqual(sorted(flushed), ['a', 'b'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from ratelimit import RateLimiter
+
+LIMITS = {'gpt-4': {'global': (3, 1000), 'group': (2, 1000), 'user': (1, 100)}}
+
+@patch('ratelimit.time.time', return_value=1000.0)
+class TestRateLimiter(unittest.TestCase):
+    def test_user_bucket_limits_requests(self, now):
+        limiter = RateLimiter('test.ratelimit', LIMITS, window=3600, path=None)
+        self.assertEqual(limiter.acquire('gpt-4-0613', 'g1', 'u1', 10), (True, 0.0))
+        allowed, retry_after = limiter.acquire('gpt-4-0613', 'g1', 'u1', 10)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 3600)
+        self.assertTrue(limiter.acquire('gpt-4-0613', 'g1', 'u2', 10)[0])
+        self.assertFalse(limiter.acquire('gpt-4-0613', 'g1', 'u3', 10)[0])     # group bucket is empty now
+
+    def test_buckets_refill(self, now):
+        limiter = RateLimiter('test.ratelimit', LIMITS, window=3600, path=None)
+        limiter.acquire('gpt-4', 'g1', 'u1', 10)
+        now.return_value = 1000.0 + 3600
+        self.assertTrue(limiter.acquire('gpt-4', 'g1', 'u1', 10)[0])
+
+    def test_token_usage_is_settled(self, now):
+        limiter = RateLimiter('test.ratelimit', {'gpt-4': {'global': (10, 100), 'group': (10, 100), 'user': (10, 100)}},
+                              window=3600, path=None)
+        self.assertTrue(limiter.acquire('gpt-4', 'g1', 'u1', 90)[0])
+        self.assertFalse(limiter.acquire('gpt-4', 'g1', 'u1', 90)[0])
+        limiter.settle('gpt-4', 'g1', 'u1', 90, 10)
+        self.assertTrue(limiter.acquire('gpt-4', 'g1', 'u1', 80)[0])
+
+    def test_refund_returns_the_request_and_its_tokens(self, now):
+        limiter = RateLimiter('test.ratelimit', LIMITS, window=3600, path=None)
+        self.assertTrue(limiter.acquire('gpt-4', 'g1', 'u1', 100)[0])
+        limiter.refund('gpt-4', 'g1', 'u1', 100)
+        self.assertTrue(limiter.acquire('gpt-4', 'g1', 'u1', 100)[0])
+
+    def test_global_only_calls_spend_the_global_bucket(self, now):
+        limiter = RateLimiter('test.ratelimit', LIMITS, window=3600, path=None)
+        for _ in range(2):
+            self.assertTrue(limiter.acquire('gpt-4', None, None, 400, levels=('global',))[0])
+        limiter.settle('gpt-4', None, None, 400, 450, levels=('global',))
+        self.assertEqual(limiter.bucket(('gpt-4', 'global', ''), 'tokens').level, 150)
+        self.assertFalse(limiter.acquire('gpt-4', 'g1', 'u1', 200)[0])    # one request left, but only 150 tokens
+        self.assertTrue(limiter.acquire('gpt-4', 'g1', 'u1', 100)[0])
+        self.assertNotIn((('gpt-4', 'group', 'None'), 'requests'), limiter.buckets)
+
+    def test_unlimited_models_pass(self, now):
+        limiter = RateLimiter('test.ratelimit', LIMITS, path=None)
+        self.assertEqual(limiter.acquire('gpt-3.5-turbo', 'g1', 'u1', 10), (True, 0.0))
+
+    def test_levels_survive_restart(self, now):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'rate_limits.json')
+            RateLimiter('test.ratelimit', LIMITS, path=path).acquire('gpt-4', 'g1', 'u1', 10)
+            self.assertFalse(RateLimiter('test.ratelimit', LIMITS, path=path).acquire('gpt-4', 'g1', 'u1', 10)[0])
+
+if __name__ == "__main__":
+    unittest.main()
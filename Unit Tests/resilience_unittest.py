@@ -0,0 +1,92 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from resilience import CircuitBreaker, CircuitOpenError, async_call_with_retry, call_with_retry
+
+class Upstream(Exception):
+    pass
+
+def flaky(failures, result='ok'):
+    calls = []
+    def call(timeout):
+        calls.append(timeout)
+        if len(calls) <= failures:
+            raise Upstream()
+        return result
+    return call, calls
+
+def retryable(error):
+    return isinstance(error, Upstream)
+
+@patch('resilience.time.sleep')
+class TestCallWithRetry(unittest.TestCase):
+    def test_retries_until_success(self, sleep):
+        call, calls = flaky(2)
+        self.assertEqual(call_with_retry(call, CircuitBreaker('test.breaker'), retryable, deadline=60), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_non_retryable_error_is_raised_at_once(self, sleep):
+        def call(timeout):
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            call_with_retry(call, CircuitBreaker('test.breaker'), retryable, deadline=60)
+        sleep.assert_not_called()
+
+    @patch('resilience.random.uniform', return_value=0)
+    def test_attempts_are_cut_to_the_deadline(self, uniform, sleep):
+        clock = [0.0]
+        def call(timeout):
+            timeouts.append(timeout)
+            clock[0] += timeout     # every attempt times out
+            raise Upstream()
+        with patch('resilience.time.monotonic', side_effect=lambda: clock[0]):
+            for deadline, expected in ((70, [30, 30, 10]), (63, [30, 30])):
+                clock[0], timeouts = 0.0, []
+                with self.assertRaises(Upstream):
+                    call_with_retry(call, CircuitBreaker('test.breaker'), retryable, deadline, attempt_timeout=30,
+                                    retries=5, min_attempt=5)
+                self.assertEqual(timeouts, expected)
+                self.assertLessEqual(clock[0], deadline)
+
+    def test_breaker_opens_and_fails_fast(self, sleep):
+        breaker = CircuitBreaker('test.breaker', failure_threshold=2, reset_timeout=60)
+        call, calls = flaky(10)
+        with self.assertRaises(CircuitOpenError):
+            call_with_retry(call, breaker, retryable, deadline=60, retries=5)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(breaker.state, 'open')
+
+    def test_half_open_probe_closes_breaker(self, sleep):
+        breaker = CircuitBreaker('test.breaker', failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+@patch('resilience.asyncio.sleep')
+class TestAsyncCallWithRetry(unittest.TestCase):
+    def test_retries_until_success(self, sleep):
+        call, calls = flaky(2)
+        async def attempt(timeout):
+            return call(timeout)
+        result = asyncio.run(async_call_with_retry(attempt, CircuitBreaker('test.breaker'), retryable, deadline=60))
+        self.assertEqual(result, 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_open_breaker_rejects(self, sleep):
+        breaker = CircuitBreaker('test.breaker', failure_threshold=1)
+        breaker.record_failure()
+        async def attempt(timeout):
+            return 'ok'
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(async_call_with_retry(attempt, breaker, retryable, deadline=60))
+
+if __name__ == "__main__":
+    unittest.main()
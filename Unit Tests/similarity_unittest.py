@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from similarity import QuestionIndex, question_terms
+
+class TestQuestionIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = QuestionIndex('test.similar', path=None)
+        self.add(self.index, 'what is a list comprehension', ['answer', 'gpt'])
+
+    def add(self, index, question, answer, model='gpt', context=None):
+        index.add(index.probe(question, model, context), answer)
+
+    def lookup(self, question, model='gpt', context=None):
+        return self.index.lookup(self.index.probe(question, model, context))
+
+    def test_paraphrase_is_matched(self):
+        self.assertEqual(question_terms('what is a list comprehension'), question_terms('explain list comprehensions pls'))
+        self.assertEqual(self.lookup('explain list comprehensions pls'), ['answer', 'gpt'])
+
+    def test_different_question_is_not_matched(self):
+        self.assertIsNone(self.lookup('what is a dict comprehension'))
+        self.assertIsNone(self.lookup('what is a list comprehension', 'gpt-4'))
+
+    def test_context_dependent_questions_are_skipped(self):
+        self.add(self.index, 'why?', ['because', 'gpt'])
+        self.assertIsNone(self.lookup('why'))
+
+    def test_follow_ups_only_match_in_the_same_context(self):
+        self.add(self.index, 'what does the second line of that code do', ['answer a', 'gpt'], context='code a')
+        self.assertEqual(self.lookup('what does the second line of that code do', context='code a'), ['answer a', 'gpt'])
+        self.assertIsNone(self.lookup('what does the second line of that code do', context='code b'))
+        self.assertIsNone(self.lookup('what does the second line of that code do'))
+
+    def test_pasted_code_is_not_indexed(self):
+        self.assertIsNone(self.index.probe('why does this fail\nfor i in range(10):\n    print(i)', 'gpt'))
+        self.assertIsNone(self.index.probe(' '.join(f'name{i}' for i in range(60)), 'gpt'))
+
+    def test_oldest_entries_are_evicted(self):
+        index = QuestionIndex('test.similar', max_entries=1, path=None)
+        self.add(index, 'what is a list comprehension', ['first', 'gpt'])
+        self.add(index, 'how do closures capture variables', ['second', 'gpt'])
+        self.assertIsNone(index.lookup(index.probe('what is a list comprehension', 'gpt')))
+        self.assertEqual(len(index.buckets), index.bands)
+
+if __name__ == "__main__":
+    unittest.main()
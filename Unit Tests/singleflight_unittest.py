@@ -0,0 +1,143 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from metrics import metrics
+from singleflight import AsyncSingleFlight, SingleFlight
+
+class Upstream(Exception):
+    pass
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight(f'test.inflight.{self.id()}')
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.calls = []
+
+    def slow_call(self, result):
+        self.calls.append(result)
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def run_followers(self, count):
+        results = []
+        def follow():
+            try:
+                results.append(self.flight.do('key', self.slow_call, 'follower'))
+            except Upstream as error:
+                results.append(error)
+        threads = [threading.Thread(target=follow) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def wait_for_followers(self, count):
+        # A follower counts itself as shared once it holds the leader's call
+        deadline = time.monotonic() + 5
+        while metrics.counters.get(f'{self.flight.name}.shared', 0) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_followers_share_the_leaders_result(self):
+        leader = threading.Thread(target=lambda: self.calls.append(self.flight.do('key', self.slow_call, 'leader')))
+        leader.start()
+        self.started.wait(5)
+        threads, results = self.run_followers(3)
+        self.wait_for_followers(3)
+        self.release.set()
+        for thread in threads + [leader]:
+            thread.join(5)
+        self.assertEqual(self.calls, ['leader', ('leader', False)])
+        self.assertEqual(results, [('leader', True)] * 3)
+        self.assertEqual(self.flight.calls, {})
+
+    def test_error_reaches_every_caller(self):
+        error = Upstream()
+        leader_errors = []
+        def lead():
+            try:
+                self.flight.do('key', self.slow_call, error)
+            except Upstream as raised:
+                leader_errors.append(raised)
+        leader = threading.Thread(target=lead)
+        leader.start()
+        self.started.wait(5)
+        threads, results = self.run_followers(2)
+        self.wait_for_followers(2)
+        self.release.set()
+        for thread in threads + [leader]:
+            thread.join(5)
+        self.assertEqual(leader_errors, [error])
+        self.assertEqual(results, [error, error])
+        self.assertEqual(self.calls, [error])
+
+    def test_different_keys_do_not_share(self):
+        self.release.set()
+        self.assertEqual(self.flight.do('a', self.slow_call, 1), (1, False))
+        self.assertEqual(self.flight.do('b', self.slow_call, 2), (2, False))
+        self.assertEqual(self.calls, [1, 2])
+
+class TestAsyncSingleFlight(unittest.TestCase):
+    def run_flight(self, scenario):
+        return asyncio.run(scenario(AsyncSingleFlight('test.async_inflight')))
+
+    def test_followers_share_the_leaders_result(self):
+        calls = []
+        async def call(result):
+            calls.append(result)
+            await asyncio.sleep(0.01)
+            return result
+        async def scenario(flight):
+            return await asyncio.gather(*(flight.do('key', call, i) for i in range(4)))
+        self.assertEqual(self.run_flight(scenario), [(0, False), (0, True), (0, True), (0, True)])
+        self.assertEqual(calls, [0])
+
+    def test_error_reaches_every_caller(self):
+        async def call():
+            await asyncio.sleep(0.01)
+            raise Upstream()
+        async def scenario(flight):
+            results = await asyncio.gather(*(flight.do('key', call) for _ in range(3)), return_exceptions=True)
+            return results, flight.calls
+        results, calls = self.run_flight(scenario)
+        self.assertTrue(all(isinstance(result, Upstream) for result in results))
+        self.assertEqual(calls, {})
+
+    def test_cancelled_follower_leaves_the_call_running(self):
+        async def call():
+            await asyncio.sleep(0.05)
+            return 'answer'
+        async def scenario(flight):
+            leader = asyncio.create_task(flight.do('key', call))
+            follower = asyncio.create_task(flight.do('key', call))
+            await asyncio.sleep(0.01)
+            follower.cancel()
+            return await leader, follower.cancelled()
+        self.assertEqual(self.run_flight(scenario), (('answer', False), True))
+
+    def test_follower_of_a_cancelled_leader_makes_the_call(self):
+        calls = []
+        async def call(name):
+            calls.append(name)
+            await asyncio.sleep(0.05)
+            return name
+        async def scenario(flight):
+            leader = asyncio.create_task(flight.do('key', call, 'leader'))
+            await asyncio.sleep(0.01)
+            follower = asyncio.create_task(flight.do('key', call, 'follower'))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower, leader.cancelled(), flight.calls
+        self.assertEqual(self.run_flight(scenario), (('follower', False), True, {}))
+        self.assertEqual(calls, ['leader', 'follower'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from conversation import Conversation
+from storage import SqliteBackend, SqliteStore
+
+class WordTokenizer:
+    def encode(self, text):
+        return text.split()
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SqliteStore(os.path.join(self.tmpdir.name, 'test.sqlite3'), batch_size=4)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_conversation_round_trip(self):
+        conversation = Conversation(WordTokenizer(), SqliteBackend(self.store, 'g1_u1'))
+        conversation.history_token_limit = 4
+        for text in ['a b', 'c d', 'e f']:
+            conversation.add_message_to_history('user', text)
+        self.store.flush()
+        reloaded = Conversation(WordTokenizer(), SqliteBackend(self.store, 'g1_u1'))
+        self.assertEqual(reloaded.messages(), conversation.messages())
+        self.assertEqual(self.store.token_total('g1_u1'), 4)
+
+    def test_writes_are_batched(self):
+        for i in range(3):
+            self.store.record_execution('g1', 'u1', f'print({i})', f'{i}\n', False)
+        self.assertEqual(self.store.pending, 3)
+        self.store.record_execution('g1', 'u1', '1/0', 'Traceback ...', True)
+        self.assertEqual(self.store.pending, 0)
+
+    def test_recent_executions_are_scoped(self):
+        self.store.record_execution('g1', 'u1', 'x = 1', '', False)
+        self.store.record_execution('g1', 'u2', '1/0', 'Traceback ...', True)
+        self.store.record_execution('g1', 'u1', 'print(x)', '1\n', False)
+        self.store.flush()
+        executions = self.store.recent_executions('g1', 'u1', limit=2)
+        self.assertEqual([e['code'] for e in executions], ['x = 1', 'print(x)'])
+        self.assertTrue(self.store.recent_executions('g1', 'u2')[0]['is_error'])
+
+    def test_flushed_execution_is_visible_to_another_process(self):
+        other = SqliteStore(self.store.path)     # stands in for the AI bot's process
+        try:
+            self.store.record_execution('g1', 'u1', '1/0', 'Traceback ...', True)
+            self.store.flush()
+            self.assertEqual(other.recent_executions('g1', 'u1', 1),
+                             [{'code': '1/0', 'output': 'Traceback ...', 'is_error': True}])
+        finally:
+            other.close()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_forked_worker_uses_its_own_connection(self):
+        self.store.record_execution('g1', 'u1', 'print(1)', '1\n', False)
+        self.store.flush()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.store.record_execution('g1', 'u1', 'print(2)', '2\n', False)
+                self.store.flush()
+                os._exit(0)
+            except BaseException:
+                os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.store.flush()
+        outputs = [execution['output'] for execution in self.store.recent_executions('g1', 'u1', 5)]
+        self.assertEqual(sorted(outputs), ['1\n', '2\n'])
+
+if __name__ == "__main__":
+    unittest.main()
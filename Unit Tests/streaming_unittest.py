@@ -0,0 +1,37 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+from streaming import rewrite_code_fences, sentence_chunks
+
+def split_into_deltas(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+class TestStreaming(unittest.TestCase):
+    def test_fence_rewrite_matches_batch_rewrite(self):
+        text = '  Here is an example:\n```python\nfor i in range(3):\n    print(i)\n```\nThat prints 0, 1 and 2.\n```'
+        expected = '\n'.join('-'*25 if line.startswith('```') else line for line in text.strip().splitlines())
+        for size in (1, 2, 3, 7, len(text)):
+            self.assertEqual(''.join(rewrite_code_fences(split_into_deltas(text, size))), expected)
+
+    def test_first_sentence_is_posted_early(self):
+        chunks = list(sentence_chunks(split_into_deltas('Short answer. ' + 'More words here. ' * 10, 4), min_chunk=100))
+        self.assertEqual(chunks[0], 'Short answer.')
+        self.assertTrue(all(len(chunk) >= 90 for chunk in chunks[1:-1]))
+
+    def test_chunks_respect_limit(self):
+        chunks = list(sentence_chunks(split_into_deltas('x' * 1000 + '. end', 13), chunk_size=449))
+        self.assertTrue(all(len(chunk) <= 449 for chunk in chunks))
+        self.assertEqual(''.join(chunks).replace(' ', ''), 'x' * 1000 + '.end')
+
+    def test_trailer_joins_last_chunk(self):
+        model = {}
+        def deltas():
+            yield from split_into_deltas('One sentence. Another one without a boundary', 5)
+            model['name'] = 'gpt-test'
+        chunks = list(sentence_chunks(deltas(), trailer=lambda: f'model: {model["name"]}'))
+        self.assertEqual(chunks, ['One sentence.', 'Another one without a boundary\n\nmodel: gpt-test'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbots'))
+# config.py holds the deployment's secrets and isn't committed
+sys.modules.setdefault('config', types.SimpleNamespace(OPENAI_API_KEY='test-key', AI_CHATBOTID='ai-bot', PY_CHATBOTID='py-bot'))
+from ai_chatbot import AiBot
+from tokenizer import LazyTokenizer
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+class FakeTiktoken:
+    def __init__(self):
+        self.loads = []
+
+    def get_encoding(self, name):
+        self.loads.append(name)
+        return WordEncoding()
+
+class TestLazyTokenizer(unittest.TestCase):
+    def setUp(self):
+        self.tiktoken = FakeTiktoken()
+        patcher = patch.dict(sys.modules, {'tiktoken': self.tiktoken})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_encoding_is_loaded_on_the_first_count(self):
+        tokenizer = LazyTokenizer()
+        self.assertEqual(self.tiktoken.loads, [])
+        self.assertEqual(len(tokenizer.encode('one two three')), 3)
+        self.assertEqual(len(tokenizer.encode('four five')), 2)
+        self.assertEqual(self.tiktoken.loads, ['cl100k_base'])
+
+    def test_bot_starts_without_the_tokenizer(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        cwd = os.getcwd()
+        os.chdir(tmpdir.name)
+        try:
+            bot = AiBot('test-key')
+            bot.conversations.get('g1', 'u1')
+            self.assertEqual((self.tiktoken.loads, bot.tokenizer.encoding), ([], None))
+            bot.conversations.get('g1', 'u1').add_message_to_history('user', 'what is a list')
+            self.assertEqual(self.tiktoken.loads, ['cl100k_base'])
+            bot.persister.stop()    # its files are relative to the temporary directory
+        finally:
+            os.chdir(cwd)
+            tmpdir.cleanup()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,48 @@
+import startup   # first, so the start time is taken before the imports below
+
+from contextlib import contextmanager
 from enum import Enum
-import json
+import re
 import time
 
 from flask import Flask, request
-import requests
-import openai
-import tiktoken
 
+from budget import PROMPT_TOKEN_TARGET, SUMMARIZED_PROMPT_TOKEN_TARGET, MessageTooLongError, PromptBudgeter
+from cache import ResponseCache
+from chunker import split_message
 from config import OPENAI_API_KEY, AI_CHATBOTID
+from conversation import ConversationStore
+from dedup import SeenSet, accept_webhook
+from delivery import DelayedNotice, Outbox
+import http_clients
+from jobs import Scheduler
+from metrics import metrics
+from persistence import WriteBehindPersister
+from ratelimit import RateLimiter, model_family
+from resilience import CircuitBreaker, CircuitOpenError, call_with_retry
+from similarity import QuestionIndex
+from singleflight import SingleFlight
+from streaming import collect, rewrite_code_fences, sentence_chunks
+from storage import SqliteStore
+from summary import SUMMARY_PREFIX, SUMMARY_TOKEN_LIMIT, Summarizer
+from tokenizer import LazyTokenizer
 
 SYSTEM_PROMPT = """
 Act as a programming teacher. Answer any programming coding related questions as if the student is a beginner. Keep your answers short.
 """
-HISTORY_TOKEN_LIMIT = 2000
 OUTPUT_TOKEN_LIMIT = 500
+OPENAI_REQUEST_TIMEOUT = 30     # seconds per attempt
+OPENAI_DEADLINE = 60            # seconds across all attempts, the last one is cut short to fit
+UPSTREAM_ERROR_MESSAGE = 'Sorry, the AI service is having trouble right now. Please try again in a minute.'
+MESSAGE_TOO_LONG_MESSAGE = 'Sorry, your message is too long for me to answer. Please shorten it and ask again.'
+STREAM_RESPONSES = False    # post the answer sentence by sentence while it is generated
+ROLLING_SUMMARY = True      # fold evicted history into a short summary instead of dropping it
+SUMMARY_MODEL = "gpt-3.5-turbo"
+SUMMARY_RATE_LEVELS = ('global',)
+CACHE_BYPASS_KEYWORD = '!fresh'
+CACHED_MARKER = f'(cached answer, add {CACHE_BYPASS_KEYWORD} to your question for a new one)'
+THINKING_MESSAGE = 'Thinking...'
+THINKING_DELAY = 3.0    # seconds to wait for the answer before telling the group it is coming
 AIBOT_USERID = '879522'
 AIBOT_NAME = '@ai'
 
@@ -23,154 +52,300 @@ class CommandType(Enum):
     HELP = '!help'
     WHY = '!why'
 
-class Conversation:
-    def __init__(self, tokenizer):
-        self.tokenizer = tokenizer
-        self.history_token_limit = HISTORY_TOKEN_LIMIT
-        self.conversation_history = self.load_conversation()
-
-    def save_conversation(self):
-        with open('conversation.json', 'w') as file:
-            json.dump(self.conversation_history, file)
-
-    def load_conversation(self):
-        try:
-            with open('conversation.json', 'r') as file:
-                return json.load(file)
-        except FileNotFoundError:       # If the file doesn't exist, return an empty list
-            return []
-
-    def add_message_to_history(self, role, content):
-        self.conversation_history.append({'role': role, 'content': content})
-        while self.count_tokens() > self.history_token_limit:
-            self.conversation_history.pop(0)
-        self.save_conversation()
-
-    def count_tokens(self):
-        tokens = " ".join([m['content'] for m in self.conversation_history])
-        return len(self.tokenizer.encode(tokens))
+INSTANT_COMMANDS = {CommandType.PING, CommandType.HELP, CommandType.CLEARVARS}
 
 class AiBot:
-    def __init__(self, api_key):
-        openai.api_key = api_key
-        self.openai = openai
-        tokenizer = tiktoken.get_encoding("cl100k_base")
-        self.conversation = Conversation(tokenizer)
+    def __init__(self, api_key, storage=None):
+        self.api_key = api_key
+        self.storage = storage if storage is not None else SqliteStore()     # also where PyBot records executions
+        self.openai_module = None
+        self.tokenizer = LazyTokenizer()     # loaded on the first request that needs token counts
+        self.budgeter = PromptBudgeter(self.tokenizer, SYSTEM_PROMPT,
+                                       SUMMARIZED_PROMPT_TOKEN_TARGET if ROLLING_SUMMARY else PROMPT_TOKEN_TARGET)
+        self.ready = False
+        self.persister = WriteBehindPersister('aibot.persister')
+        self.scheduler = Scheduler('aibot.jobs')
+        self.outbox = Outbox('aibot.outbox', self.send_message)
+        self.response_cache = ResponseCache('aibot.cache', persister=self.persister)
+        self.similar_questions = QuestionIndex('aibot.similar', persister=self.persister)
+        self.inflight = SingleFlight('aibot.inflight')
+        self.seen = SeenSet('aibot.seen')
+        self.breaker = CircuitBreaker('aibot.openai')
+        self.rate_limiter = RateLimiter('aibot.ratelimit', persister=self.persister)
+        self.summarizer = Summarizer(self.complete_summary) if ROLLING_SUMMARY else None
+        self.conversations = ConversationStore(self.tokenizer, storage=self.storage, persister=self.persister,
+                                               on_evict=self.summarizer.submit if self.summarizer else None,
+                                               history_limits=self.history_limits)
         self.app = Flask(__name__)
         self.output_token_limit = OUTPUT_TOKEN_LIMIT
         self.app.route('/', methods=['POST'])(self.webhook)
-        self.gpt4_requests = 0
-        self.first_gpt4_request = 0
+        self.app.route('/metrics', methods=['GET'])(self.metrics_report)
+
+    @property
+    def openai(self):
+        if self.openai_module is None:
+            import openai   # deferred, importing it is a large share of startup time
+            openai.api_key = self.api_key
+            http_clients.use_for_openai(openai)
+            self.openai_module = openai
+        return self.openai_module
+
+    def preload(self):
+        # Loads what the first question would otherwise load on the request path
+        self.tokenizer.load()
+        self.budgeter.prepare()
+        self.openai
+
+    def mark_ready(self):
+        # Called once the first webhook has been handled, so cold start covers everything that request needed
+        if not self.ready:
+            self.ready = True
+            metrics.set_gauge('aibot.cold_start', time.monotonic() - startup.PROCESS_START)
 
     def webhook(self):
-        data = request.get_json()
-        self.process_message(data['user_id'], data['text'])
-        return "ok", 200
+        try:
+            data = request.get_json()
+            if not accept_webhook(data, self.seen):
+                return "ok", 200
+            if not self.process_message(data.get('group_id'), data['user_id'], data['text']):
+                self.seen.discard(data.get('id'))    # so GroupMe's retry is handled
+                return "busy", 503
+            return "ok", 200
+        finally:
+            self.mark_ready()
+
+    def metrics_report(self):
+        return metrics.snapshot()
+
+    def process_message(self, group_id, user_id, text):
+        # Instant commands run right away, anything that calls the model is queued in its lane.
+        # Returns False when the lane is full.
+        route = self.route(user_id, text)
+        if route is None:
+            return True
+        lane, handler, argument = route
+        if lane is None:
+            self.run_job(handler, argument, group_id, user_id)
+            return True
+        return self.scheduler.submit(lane, self.run_job, handler, argument, group_id, user_id)
 
-    def process_message(self, user_id, text):
+    def route(self, user_id, text):
+        # Returns (lane, handler, argument), with lane None for instant commands, or None if the message isn't for the bot
         if user_id != AIBOT_USERID and text.strip().startswith(AIBOT_NAME):  # this code doesnt check for a @ai command
             text = text.split('@ai', 1)[1].strip()  # Remove '@ai' from the start of the message
             command = CommandType(text.lower()) if text.lower() in [c.value for c in CommandType] else None
-            if command:  
-                self.handle_command(command) 
-                return
+            if command in INSTANT_COMMANDS:
+                return None, self.handle_command, command
+            elif command:  
+                return 'why', self.handle_command, command
             elif "use gpt4" in text.lower():
-                self.use_gpt4(text)
-                return       
+                return 'gpt-4', self.use_gpt4, text
             else:
-                self.handle_text(text)
+                return 'gpt-3.5', self.handle_text, text
+        return None
+
+    def run_job(self, handler, argument, group_id, user_id):
+        conversation = self.conversations.get(group_id, user_id, hold=True)
+        try:
+            handler(argument, conversation)
+        except (CircuitOpenError, self.openai.error.OpenAIError):
+            metrics.increment('aibot.upstream_errors')
+            self.post_message(UPSTREAM_ERROR_MESSAGE, group_id)
+        finally:
+            conversation.release()
 
-    def handle_command(self, command):
+    def history_limits(self):
+        # Conversations hold exactly what fits a gpt-3.5 prompt next to the largest possible summary
+        summary_tokens = len(self.tokenizer.encode(SUMMARY_PREFIX)) + SUMMARY_TOKEN_LIMIT if self.summarizer else 0
+        return self.budgeter.history_limits("gpt-3.5-turbo", self.output_token_limit, summary_tokens)
+
+    def handle_command(self, command, conversation):
         command_handlers = {
             CommandType.CLEARVARS: self.clear_conversation,
             CommandType.PING: self.ping,
             CommandType.HELP: self.help,
             CommandType.WHY: self.why,
         }
-        command_handlers[command]()
-
-    def clear_conversation(self):
-        self.conversation.conversation_history = []
-        self.conversation.save_conversation()
-        self.post_message('Conversation history has been cleared.')
-
-    def ping(self):
-        self.post_message('AI Chat is up and running.')
-
-    def why(self):
-        self.handle_why_command()
-
-    def handle_why_command(self):
-        with open("chat_history.json", "r") as file: # this is a file that py_chatbot.py creates
-            chat_history = json.load(file)
-            if self.is_last_message_error(chat_history):
-                last_two_items = chat_history[-2:]
-                last_two_items.append({"role": "user", "content" : "Could you please interpret the nature of this error message? Additionally, please illustrate an appropriate solution, including a code example demonstrating the correct approach. Keep your answer somewhat short."})
-                messages = [{'role': 'system', 'content': SYSTEM_PROMPT}]
-                messages.extend(last_two_items)
-                response_text = self.get_response_text(messages)
-                self.conversation.add_message_to_history('assistant', response_text[0])
-                self.post_message(response_text[0])
-            else:
-                self.post_message('The last message was not an error.')
-
-    def is_last_message_error(self, chat_history):
-        last_message = chat_history[-1]['content'].lower()
-        error_keywords = ['error', 'exception', 'traceback']
-        for keyword in error_keywords:
-            if keyword in last_message:
-                return True
-        return False
+        command_handlers[command](conversation)
+
+    def clear_conversation(self, conversation):
+        conversation.clear()
+        self.post_message('Conversation history has been cleared.', conversation.key[0])
+
+    def ping(self, conversation):
+        self.post_message('AI Chat is up and running.', conversation.key[0])
+
+    def why(self, conversation):
+        self.handle_why_command(conversation)
+
+    def handle_why_command(self, conversation):
+        # PyBot records every execution in the shared SQLite store, indexed by group and user
+        executions = self.storage.recent_executions(*conversation.key, 1)
+        if executions and executions[-1]['is_error']:
+            execution = executions[-1]
+            messages = [{'role': 'system', 'content': SYSTEM_PROMPT},
+                        {'role': 'user', 'content': execution['code']},
+                        {'role': 'assistant', 'content': execution['output']},
+                        {"role": "user", "content" : "Could you please interpret the nature of this error message? Additionally, please illustrate an appropriate solution, including a code example demonstrating the correct approach. Keep your answer somewhat short."}]
+            prompt_tokens = self.budgeter.count_messages(messages)
+            reserved = self.reserve_tokens("gpt-3.5-turbo", conversation, prompt_tokens)
+            if reserved is None:
+                return
+            with self.refund_on_failure("gpt-3.5-turbo", conversation, reserved):
+                response_text = self.get_response_text(messages, group_id=conversation.key[0])
+            self.settle_tokens("gpt-3.5-turbo", conversation, reserved, prompt_tokens, response_text[0])
+            conversation.add_message_to_history('assistant', response_text[0])
+            self.post_message(response_text[0], conversation.key[0])
+        else:
+            self.post_message('The last message was not an error.', conversation.key[0])
     
-    def use_gpt4(self, text):
-        current_time = time.time()
-        # 600 seconds = 10 minutes, 900 seconds = 15 minutes, 1800 seconds = 30 minutes, 3600 seconds = 1 hour
-        if current_time - self.first_gpt4_request > 3600:
-            self.gpt4_requests = 0
-            self.first_gpt4_request = 0
-        if self.gpt4_requests > 10 and current_time - self.first_gpt4_request < 3600:
-            minutes_left = int((3600 - (current_time - self.first_gpt4_request)) / 60)
-            self.post_message(f"Sorry, only 10 GPT4 requests allowed per hour. Please try again in {minutes_left} minutes.")
+    def use_gpt4(self, text, conversation):
+        gptmodel = "gpt-4-0613"
+        messages = [{'role': 'system', 'content': SYSTEM_PROMPT},
+                    {'role': 'user', 'content': text}]
+        prompt_tokens = self.budgeter.count_messages(messages)
+        reserved = self.reserve_tokens(gptmodel, conversation, prompt_tokens)
+        if reserved is None:
             return
-        else:
-            self.conversation.add_message_to_history('user', text)
-            messages = [{'role': 'system', 'content': SYSTEM_PROMPT},
-                        {'role': 'user', 'content': text}]
-            response_text = self.get_response_text(messages, gptmodel = "gpt-4-0613")
-            self.conversation.add_message_to_history('assistant', response_text[0])
-            self.post_message(response_text[0])
-            self.post_message(f'This response was generated using model: {response_text[1]}')
-            self.gpt4_requests += 1
-            if self.gpt4_requests == 1:
-                self.first_gpt4_request = current_time
-            
-    def help(self):
+        conversation.add_message_to_history('user', text)
+        with self.refund_on_failure(gptmodel, conversation, reserved):
+            response_text = self.get_response_text(messages, gptmodel, conversation.key[0])
+        self.settle_tokens(gptmodel, conversation, reserved, prompt_tokens, response_text[0])
+        conversation.add_message_to_history('assistant', response_text[0])
+        self.post_answer(response_text[0], self.model_trailer(response_text[1]), conversation.key[0])
+
+    def reserve_tokens(self, gptmodel, conversation, prompt_tokens):
+        # Reserves the prompt plus the largest possible answer; settle_tokens returns what wasn't used
+        reserved = prompt_tokens + self.output_token_limit
+        allowed, retry_after = self.rate_limiter.acquire(gptmodel, *conversation.key, reserved)
+        if not allowed:
+            minutes_left = int(retry_after / 60) + 1
+            self.post_message(f"Sorry, the {model_family(gptmodel)} request limit has been reached. Please try again in {minutes_left} minutes.", conversation.key[0])
+            return None
+        return reserved
+
+    def settle_tokens(self, gptmodel, conversation, reserved, prompt_tokens, response_text):
+        used = prompt_tokens + len(self.tokenizer.encode(response_text))
+        self.rate_limiter.settle(gptmodel, *conversation.key, reserved, used)
+
+    def complete_summary(self, messages, max_tokens):
+        # Summaries count against the global buckets like any call, but no group or user asked for them.
+        # Runs on the summarizer thread, so when the buckets are empty it waits for them to refill
+        prompt_tokens = self.budgeter.count_messages(messages)
+        reserved = prompt_tokens + max_tokens
+        while True:
+            allowed, retry_after = self.rate_limiter.acquire(SUMMARY_MODEL, None, None, reserved, SUMMARY_RATE_LEVELS)
+            if allowed:
+                break
+            time.sleep(retry_after)
+        try:
+            response = self.complete(messages, SUMMARY_MODEL, max_tokens)
+        except Exception:
+            self.rate_limiter.refund(SUMMARY_MODEL, None, None, reserved, SUMMARY_RATE_LEVELS)
+            raise
+        used = prompt_tokens + len(self.tokenizer.encode(response['choices'][0]['message']['content']))
+        self.rate_limiter.settle(SUMMARY_MODEL, None, None, reserved, used, SUMMARY_RATE_LEVELS)
+        return response
+
+    @contextmanager
+    def refund_on_failure(self, gptmodel, conversation, reserved):
+        # A call that fails upstream gives the request and its tokens back, so errors don't spend the user's limit
+        try:
+            yield
+        except Exception:
+            self.rate_limiter.refund(gptmodel, *conversation.key, reserved)
+            raise
+
+    def help(self, conversation):
         commands = [
             {'command':'!clear', 'description': 'Clears the conversation history.'},
             {'command':'!ping', 'description': 'Checks if the aibot server is running.'},
             {'command':'!why', 'description': 'Explains the last error.'},
             {'command':'!help', 'description': 'Displays this help message'},
-            {'command':f'{AIBOT_NAME} <question>', 'description': 'ask aibot a question'}
+            {'command':f'{AIBOT_NAME} <question>', 'description': 'ask aibot a question'},
+            {'command':f'{AIBOT_NAME} <question> {CACHE_BYPASS_KEYWORD}', 'description': 'ask without reusing a cached answer'}
         ]
         help_message = "Available commands for aibot:\n" + "\n".join(f"{command['command']}: {command['description']}" for command in commands)
-        self.post_message(help_message)
-
-    def handle_text(self, text):
-        self.conversation.add_message_to_history('user', text)
-        messages = [{'role': 'system', 'content': SYSTEM_PROMPT}]
-        messages.extend([{'role': m['role'], 'content': m['content']} for m in self.conversation.conversation_history])
-        response_text = self.get_response_text(messages)
-        self.conversation.add_message_to_history('assistant', response_text[0])
-        self.post_message(response_text[0])
-        self.post_message(f'This response was generated using model: {response_text[1]}')
-
-    def get_response_text(self, messages, gptmodel="gpt-3.5-turbo"):
-        self.post_message("Thinking...")
-        response = self.openai.ChatCompletion.create(
-            model=gptmodel, 
-            messages=messages,
-            max_tokens=self.output_token_limit
-        )
+        self.post_message(help_message, conversation.key[0])
+
+    def handle_text(self, text, conversation, gptmodel="gpt-3.5-turbo"):
+        request = self.prepare_text(text, conversation, gptmodel)
+        if request is None:
+            return
+        # Identical questions asked while this one is in flight wait for it instead of calling the API again
+        with self.refund_on_failure(gptmodel, conversation, request['reserved']):
+            response_text, shared = self.inflight.do(request['flight_key'], self.generate_response, request['messages'],
+                                                     gptmodel, conversation.key[0])
+        self.finish_text(request, response_text, shared, conversation, gptmodel, streamed=STREAM_RESPONSES)
+
+    def prepare_text(self, text, conversation, gptmodel):
+        # Everything before the model call. Returns None when the question was answered from the cache
+        # or turned away for its length or by the rate limiter
+        use_cache = CACHE_BYPASS_KEYWORD not in text.lower()
+        text = re.sub(re.escape(CACHE_BYPASS_KEYWORD), '', text, flags=re.IGNORECASE).strip()
+        # The previous answer is part of both keys so follow-up questions aren't answered out of context
+        previous_answer = conversation.last_content('assistant')
+        cache_key = self.response_cache.key(gptmodel, text, [SYSTEM_PROMPT, previous_answer])
+        probe = self.similar_questions.probe(text, gptmodel, previous_answer)
+        cached = self.cached_answer(cache_key, probe) if use_cache else None
+        if cached is not None:
+            conversation.add_message_to_history('user', text)
+            conversation.add_message_to_history('assistant', cached[0])
+            self.post_answer(cached[0], f'{self.model_trailer(cached[1])} {CACHED_MARKER}', conversation.key[0])
+            return None
+        # The question joins the history only once it is allowed, so a rate-limited one isn't sent with the next prompt
+        question = {'role': 'user', 'content': text, 'tokens': len(self.tokenizer.encode(text))}
+        try:
+            messages, prompt_tokens = self.budgeter.build_messages(conversation.snapshot() + [question], gptmodel,
+                                                                   self.output_token_limit, conversation.summary)
+        except MessageTooLongError:
+            metrics.increment('aibot.too_long')
+            self.post_message(MESSAGE_TOO_LONG_MESSAGE, conversation.key[0])
+            return None
+        metrics.observe('aibot.prompt_tokens', prompt_tokens)
+        reserved = self.reserve_tokens(gptmodel, conversation, prompt_tokens)
+        if reserved is None:
+            return None
+        conversation.add_message_to_history('user', text, question['tokens'])
+        # !fresh asks for an answer of its own, so it never joins a normal question's call
+        return {'text': text, 'cache_key': cache_key, 'flight_key': (cache_key, use_cache), 'probe': probe,
+                'messages': messages, 'prompt_tokens': prompt_tokens, 'reserved': reserved}
+
+    def finish_text(self, request, response_text, shared, conversation, gptmodel, streamed=False):
+        if shared:
+            self.rate_limiter.settle(gptmodel, *conversation.key, request['reserved'], 0)
+        else:
+            self.settle_tokens(gptmodel, conversation, request['reserved'], request['prompt_tokens'], response_text[0])
+        if shared or not streamed:
+            self.post_answer(response_text[0], self.model_trailer(response_text[1]), conversation.key[0])
+        self.response_cache.put(request['cache_key'], list(response_text))
+        self.similar_questions.add(request['probe'], list(response_text))
+        conversation.add_message_to_history('assistant', response_text[0])
+
+    def model_trailer(self, model):
+        return f'This response was generated using model: {model}'
+
+    def post_answer(self, answer, trailer, group_id):
+        # The trailer shares the answer's last chunk instead of costing another post
+        self.post_message(f'{answer}\n\n{trailer}', group_id)
+
+    def generate_response(self, messages, gptmodel, group_id):
+        if STREAM_RESPONSES:
+            return self.stream_response_text(messages, gptmodel, group_id)   # posted while it streams
+        return self.get_response_text(messages, gptmodel, group_id)
+
+    def cached_answer(self, cache_key, probe):
+        cached = self.response_cache.get(cache_key)
+        if cached is None:
+            cached = self.similar_questions.lookup(probe)
+        return cached
+
+    def get_response_text(self, messages, gptmodel="gpt-3.5-turbo", group_id=None):
+        with self.thinking_notice(group_id):
+            response = self.complete(messages, gptmodel)
+        return self.read_response(response)
+
+    def read_response(self, response):
         response_text = response['choices'][0]['message']['content'].strip()
         lines = response_text.splitlines()
         lines = ['-'*25 if line.startswith('```') else line for line in lines]
@@ -178,28 +353,71 @@ class AiBot:
         model = response['model']
         return response_text, model
 
-    def post_message(self, msg):
-        if len(msg) > 449:
-            chunks = self.split_message_into_chunks(msg)
-            for chunk in chunks:
-                requests.post('https://api.groupme.com/v3/bots/post', params={'bot_id': AI_CHATBOTID, 'text': chunk})
-        else:
-            requests.post('https://api.groupme.com/v3/bots/post', params={'bot_id': AI_CHATBOTID, 'text': msg})
-
-    def split_message_into_chunks(self, message, chunk_size=449):
-        chunks = []
-        while len(message) > chunk_size:
-            last_period_index = message[:chunk_size].rfind('. ')
-            if last_period_index == -1:
-                chunks.append(message[:chunk_size])
-                message = message[chunk_size:]
-            else:
-                chunks.append(message[:last_period_index + 1])  # Include the period in the chunk
-                message = message[last_period_index + 2:]  # Start the next chunk after the period and space
-        chunks.append(message)
-        return chunks
+    def stream_response_text(self, messages, gptmodel="gpt-3.5-turbo", group_id=None):
+        # Posts each chunk as soon as it is complete, with the model trailer in the last one,
+        # and returns the same (text, model) as get_response_text
+        start = time.monotonic()
+        response = {'model': gptmodel}
+        parts = []
+        first = True
+        with self.thinking_notice(group_id) as notice:
+            for chunk in sentence_chunks(collect(rewrite_code_fences(self.stream_deltas(messages, gptmodel, response)), parts),
+                                         trailer=lambda: self.model_trailer(response['model'])):
+                if first:
+                    notice.cancel()
+                    metrics.observe('aibot.first_chunk', time.monotonic() - start)
+                    first = False
+                self.post_message(chunk, group_id)
+        return ''.join(parts).strip(), response['model']
+
+    def thinking_notice(self, group_id):
+        return DelayedNotice('aibot.thinking', lambda: self.post_message(THINKING_MESSAGE, group_id), THINKING_DELAY)
+
+    def stream_deltas(self, messages, gptmodel, response):
+        for event in self.complete(messages, gptmodel, stream=True):
+            response['model'] = event['model']
+            content = event['choices'][0]['delta'].get('content')
+            if content:
+                yield content
+
+    def complete(self, messages, gptmodel="gpt-3.5-turbo", max_tokens=None, stream=False):
+        return call_with_retry(lambda timeout: self.openai.ChatCompletion.create(
+            model=gptmodel, 
+            messages=messages,
+            max_tokens=max_tokens or self.output_token_limit,
+            stream=stream,
+            request_timeout=timeout
+        ), self.breaker, self.is_retryable, OPENAI_DEADLINE, OPENAI_REQUEST_TIMEOUT)
+
+    def is_retryable(self, error):
+        errors = self.openai.error
+        if isinstance(error, (errors.RateLimitError, errors.ServiceUnavailableError, errors.APIConnectionError,
+                              errors.Timeout, errors.TryAgain)):
+            return True
+        return isinstance(error, errors.APIError) and (error.http_status is None or error.http_status >= 500)
+
+    def post_message(self, msg, group_id=None):
+        # Queued for the group's sender thread, which posts in order and retries failures
+        for chunk in split_message(msg):
+            self.outbox.enqueue(group_id, chunk)
+
+    def send_message(self, text):
+        return http_clients.groupme().post(http_clients.GROUPME_POST_URL, params={'bot_id': AI_CHATBOTID, 'text': text},
+                                           timeout=http_clients.HTTP_TIMEOUT)
+
+    def prewarm_connections(self):
+        http_clients.prewarm('groupme', http_clients.GROUPME_POST_URL)
+        http_clients.prewarm('openai', http_clients.OPENAI_API_URL)
+
+    def drain(self, timeout):
+        # Everything keeps running while this waits, so the answers queued by the last jobs are
+        # posted within the same deadline
+        deadline = time.monotonic() + timeout
+        self.scheduler.drain(timeout)
+        self.outbox.drain(max(0, deadline - time.monotonic()))
 
     def run(self, host='0.0.0.0', port=5080):
+        self.prewarm_connections()
         self.app.run(host=host, port=port, debug=True)
     
 if __name__ == "__main__":
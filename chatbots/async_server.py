@@ -0,0 +1,294 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import random
+import sys
+import time
+import traceback
+
+import aiohttp
+from aiohttp import web
+
+from ai_chatbot import (AiBot, OPENAI_DEADLINE, OPENAI_REQUEST_TIMEOUT, THINKING_DELAY, THINKING_MESSAGE,
+                        UPSTREAM_ERROR_MESSAGE)
+from config import AI_CHATBOTID, OPENAI_API_KEY, PY_CHATBOTID
+from dedup import accept_webhook
+import delivery
+import http_clients
+from jobs import JOB_QUEUE_SIZE
+from metrics import metrics
+from py_chatbot import PyBot
+from resilience import CircuitOpenError, async_call_with_retry
+from singleflight import AsyncSingleFlight
+
+ASYNC_CONNECTION_LIMIT = 100    # open connections per ClientSession
+ASYNC_LANE_LIMITS = {'gpt-3.5': 64, 'why': 8, 'gpt-4': 4}     # model calls in flight per lane
+ASYNC_THREAD_WORKERS = 8        # for the handlers that still block: !why and gpt-4
+ASYNC_STEP_WORKERS = 4          # for the short blocking steps around a completion: history, journal, caches
+
+def client_session(timeout=None):
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT),
+                                 timeout=aiohttp.ClientTimeout(total=timeout))
+
+class AsyncOutbox:
+    # delivery.Outbox on the event loop: one task per group instead of one thread
+    def __init__(self, name, send, loop, min_interval=delivery.DELIVERY_MIN_INTERVAL, retries=delivery.DELIVERY_RETRIES,
+                 maxsize=delivery.DELIVERY_QUEUE_SIZE, idle_timeout=delivery.DELIVERY_IDLE_TIMEOUT):
+        self.name = name
+        self.send = send    # coroutine that posts one message and returns the HTTP status
+        self.loop = loop
+        self.min_interval = min_interval
+        self.retries = retries
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.queues = {}    # group_id -> asyncio.Queue of (enqueued, text)
+        self.tasks = {}     # group_id -> sender task
+        self.pending = 0
+        metrics.register_gauge(f'{name}.depth', lambda: self.pending)
+        metrics.register_gauge(f'{name}.senders', lambda: len(self.tasks))
+
+    def enqueue(self, group_id, text):
+        # Handlers that run in worker threads post through the loop
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if not on_loop:
+            self.loop.call_soon_threadsafe(self.put, group_id, text, time.monotonic())
+            return True
+        return self.put(group_id, text, time.monotonic())
+
+    def put(self, group_id, text, enqueued):
+        queue = self.queues.get(group_id)
+        if queue is None:
+            queue = self.queues[group_id] = asyncio.Queue()
+            self.tasks[group_id] = self.loop.create_task(self.run(group_id, queue))
+        if queue.qsize() >= self.maxsize:
+            metrics.increment(f'{self.name}.dropped')
+            return False
+        self.pending += 1
+        queue.put_nowait((enqueued, text))
+        return True
+
+    async def run(self, group_id, queue):
+        last_sent = 0
+        while True:
+            try:
+                enqueued, text = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self.queues[group_id]
+                    del self.tasks[group_id]
+                    return
+                continue
+            try:
+                await asyncio.sleep(max(0, last_sent + self.min_interval - time.monotonic()))
+                if await self.deliver(text):
+                    metrics.increment(f'{self.name}.delivered')
+                    metrics.observe(f'{self.name}.latency', time.monotonic() - enqueued)
+                else:
+                    metrics.increment(f'{self.name}.failed')
+            except Exception:
+                traceback.print_exc()
+                metrics.increment(f'{self.name}.failed')
+            finally:
+                last_sent = time.monotonic()
+                self.pending -= 1
+
+    async def deliver(self, text):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.increment(f'{self.name}.retries')
+                await asyncio.sleep(random.uniform(0, min(delivery.DELIVERY_BACKOFF_MAX,
+                                                          delivery.DELIVERY_BACKOFF_BASE * 2 ** attempt)))
+            try:
+                status = await self.send(text)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                continue
+            if status == 429 or status >= 500:
+                continue
+            return status < 400
+        return False
+
+    async def drain(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return not self.pending
+
+class AsyncAiServer:
+    # Serves AiBot from one event loop: questions are answered with ChatCompletion.acreate and posted
+    # on shared ClientSessions, so a slow completion holds a coroutine instead of a thread
+    def __init__(self, bot):
+        self.bot = bot
+        self.inflight = AsyncSingleFlight('aibot.async_inflight')
+        self.lanes = {lane: asyncio.Semaphore(limit) for lane, limit in ASYNC_LANE_LIMITS.items()}
+        self.waiting = {lane: 0 for lane in ASYNC_LANE_LIMITS}
+        self.executor = ThreadPoolExecutor(ASYNC_THREAD_WORKERS, thread_name_prefix='aibot-async')
+        # Separate, so bookkeeping never waits behind a blocking model call
+        self.steps = ThreadPoolExecutor(ASYNC_STEP_WORKERS, thread_name_prefix='aibot-step')
+        self.tasks = set()
+        self.groupme = None
+        self.openai_session = None
+        self.app = web.Application()
+        self.app.router.add_post('/', self.webhook)
+        self.app.router.add_get('/metrics', self.metrics_report)
+        self.app.on_startup.append(self.start)
+        self.app.on_cleanup.append(self.stop)
+        for lane in ASYNC_LANE_LIMITS:
+            metrics.register_gauge(f'aibot.async.{lane}.waiting', lambda lane=lane: self.waiting[lane])
+
+    async def start(self, app):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+        self.groupme = client_session(http_clients.HTTP_TIMEOUT)
+        self.openai_session = client_session()     # openai sets request_timeout on each call
+        self.bot.outbox = AsyncOutbox('aibot.outbox', self.send_message, loop)
+        await loop.run_in_executor(self.steps, self.bot.preload)    # tiktoken may download its BPE file
+
+    async def stop(self, app):
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.bot.outbox.drain()
+        await self.groupme.close()
+        await self.openai_session.close()
+        self.executor.shutdown(wait=False)
+        self.steps.shutdown(wait=False)
+
+    async def webhook(self, request):
+        try:
+            return await self.handle_webhook(await request.json())
+        finally:
+            self.bot.mark_ready()
+
+    async def handle_webhook(self, data):
+        if not accept_webhook(data, self.bot.seen):
+            return web.Response(text='ok')
+        group_id, user_id = data.get('group_id'), data['user_id']
+        route = self.bot.route(user_id, data['text'])
+        if route is None:
+            return web.Response(text='ok')
+        lane, handler, argument = route
+        if lane is None:
+            await self.run_step(self.bot.run_job, handler, argument, group_id, user_id)     # !clear writes to disk
+            return web.Response(text='ok')
+        if self.waiting[lane] >= JOB_QUEUE_SIZE:
+            metrics.increment(f'aibot.async.{lane}.rejected')
+            self.bot.seen.discard(data.get('id'))
+            return web.Response(text='busy', status=503)
+        if handler == self.bot.handle_text:
+            job = self.handle_text(lane, argument, group_id, user_id)
+        else:
+            job = self.run_in_thread(lane, handler, argument, group_id, user_id)
+        task = asyncio.create_task(job)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response(text='ok')
+
+    async def metrics_report(self, request):
+        return web.json_response(metrics.snapshot())
+
+    async def handle_text(self, lane, text, group_id, user_id, gptmodel="gpt-3.5-turbo"):
+        bot = self.bot
+        self.waiting[lane] += 1
+        async with self.lanes[lane]:
+            self.waiting[lane] -= 1
+            # Loading a conversation, appending to its journal and the cache lookups all block
+            conversation = await self.run_step(bot.conversations.get, group_id, user_id, True)
+            try:
+                request = await self.run_step(bot.prepare_text, text, conversation, gptmodel)
+                if request is None:
+                    return
+                with bot.refund_on_failure(gptmodel, conversation, request['reserved']):
+                    response_text, shared = await self.inflight.do(request['flight_key'], self.generate_response,
+                                                                   request['messages'], gptmodel, group_id)
+                await self.run_step(bot.finish_text, request, response_text, shared, conversation, gptmodel)
+            except (CircuitOpenError, bot.openai.error.OpenAIError):
+                metrics.increment('aibot.upstream_errors')
+                bot.post_message(UPSTREAM_ERROR_MESSAGE, group_id)
+            except Exception:
+                traceback.print_exc()
+                metrics.increment(f'aibot.async.{lane}.errors')
+            finally:
+                conversation.release()
+
+    async def run_step(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.steps, function, *args)
+
+    async def run_in_thread(self, lane, handler, argument, group_id, user_id):
+        self.waiting[lane] += 1
+        async with self.lanes[lane]:
+            self.waiting[lane] -= 1
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.bot.run_job, handler, argument, group_id, user_id)
+            except Exception:
+                traceback.print_exc()
+                metrics.increment(f'aibot.async.{lane}.errors')
+
+    async def generate_response(self, messages, gptmodel, group_id):
+        notice = asyncio.get_running_loop().call_later(THINKING_DELAY, self.bot.post_message, THINKING_MESSAGE, group_id)
+        try:
+            response = await self.complete(messages, gptmodel)
+        finally:
+            notice.cancel()
+        return self.bot.read_response(response)
+
+    async def complete(self, messages, gptmodel="gpt-3.5-turbo", max_tokens=None):
+        openai = self.bot.openai
+        http_clients.use_for_openai(openai, self.openai_session)
+        return await async_call_with_retry(lambda timeout: openai.ChatCompletion.acreate(
+            model=gptmodel,
+            messages=messages,
+            max_tokens=max_tokens or self.bot.output_token_limit,
+            request_timeout=timeout
+        ), self.bot.breaker, self.bot.is_retryable, OPENAI_DEADLINE, OPENAI_REQUEST_TIMEOUT)
+
+    async def send_message(self, text):
+        async with self.groupme.post(http_clients.GROUPME_POST_URL, params={'bot_id': AI_CHATBOTID, 'text': text}) as response:
+            return response.status
+
+class AsyncPyServer:
+    # Serves PyBot from an event loop. Code runs on a single worker thread because every execution
+    # shares the same variables
+    def __init__(self, bot):
+        self.bot = bot
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='pybot-exec')
+        self.tasks = set()
+        self.groupme = None
+        self.app = web.Application()
+        self.app.router.add_post('/', self.webhook)
+        self.app.router.add_get('/metrics', self.metrics_report)
+        self.app.on_startup.append(self.start)
+        self.app.on_cleanup.append(self.stop)
+
+    async def start(self, app):
+        self.groupme = client_session(http_clients.HTTP_TIMEOUT)
+        self.bot.outbox = AsyncOutbox('pybot.outbox', self.send_message, asyncio.get_running_loop())
+
+    async def stop(self, app):
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.bot.outbox.drain()
+        await self.groupme.close()
+        self.executor.shutdown(wait=False)
+
+    async def webhook(self, request):
+        data = await request.json()
+        if not accept_webhook(data, self.bot.seen):
+            return web.Response(text='ok')
+        task = asyncio.get_running_loop().run_in_executor(self.executor, self.bot.process_message,
+                                                          data.get('group_id'), data['user_id'], data['text'])
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response(text='ok')
+
+    async def metrics_report(self, request):
+        return web.json_response(metrics.snapshot())
+
+    async def send_message(self, text):
+        async with self.groupme.post(http_clients.GROUPME_POST_URL, json={'bot_id': self.bot.bot_id, 'text': text}) as response:
+            return response.status
+
+if __name__ == "__main__":
+    # python3 async_server.py [ai|py]
+    if sys.argv[1:] == ['py']:
+        web.run_app(AsyncPyServer(PyBot(PY_CHATBOTID)).app, host='0.0.0.0', port=5020)
+    else:
+        web.run_app(AsyncAiServer(AiBot(OPENAI_API_KEY)).app, host='0.0.0.0', port=5080)
@@ -0,0 +1,36 @@
+import timeit
+
+from chunker import split_message
+
+PARAGRAPH = 'Lists keep their items in order. You can add to them with append, and remove items with pop. '
+CODE = '-'*25 + '\n' + ''.join(f'    total += values[{i}] * {i}\n' for i in range(12)) + '-'*25 + '\n'
+SIZES = [2_000, 8_000, 32_000, 128_000, 512_000, 2_000_000]
+
+def legacy_split(message, chunk_size=449):
+    # The splitter AiBot used before chunker.py, kept here as the baseline
+    chunks = []
+    while len(message) > chunk_size:
+        last_period_index = message[:chunk_size].rfind('. ')
+        if last_period_index == -1:
+            chunks.append(message[:chunk_size])
+            message = message[chunk_size:]
+        else:
+            chunks.append(message[:last_period_index + 1])
+            message = message[last_period_index + 2:]
+    chunks.append(message)
+    return chunks
+
+def sample(size):
+    text = ''
+    while len(text) < size:
+        text += PARAGRAPH * 3 + '\n' + CODE
+    return text[:size]
+
+if __name__ == '__main__':
+    print(f'{"chars":>8} {"legacy us":>10} {"chunker us":>10} {"chunks":>7}')
+    for size in SIZES:
+        text = sample(size)
+        runs = max(5, 200_000 // size)
+        legacy = min(timeit.repeat(lambda: legacy_split(text), number=runs, repeat=3)) / runs
+        chunker = min(timeit.repeat(lambda: split_message(text), number=runs, repeat=3)) / runs
+        print(f'{size:>8} {legacy * 1e6:>10.0f} {chunker * 1e6:>10.0f} {len(split_message(text)):>7}')
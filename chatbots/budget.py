@@ -0,0 +1,97 @@
+import threading
+
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo-16k': 16384,
+    'gpt-3.5-turbo': 4096,
+    'gpt-4-32k': 32768,
+    'gpt-4': 8192,
+}
+PROMPT_TOKEN_TARGET = 2000
+TYPICAL_QUESTION_TOKENS = 300   # a question with a short code sample
+SUMMARIZED_PROMPT_TOKEN_TARGET = 1500   # the summary, plus a window that holds a typical question and its full answer
+TOKENS_PER_MESSAGE = 3  # every message is framed as <|start|>{role}<|message|>{content}<|end|>
+TOKENS_PER_REPLY = 3    # every reply is primed with <|start|>assistant<|message|>
+
+class MessageTooLongError(Exception):
+    pass
+
+def context_window(model):
+    for prefix, window in MODEL_CONTEXT_WINDOWS.items():   # longest prefixes are listed first
+        if model.startswith(prefix):
+            return window
+    return MODEL_CONTEXT_WINDOWS['gpt-3.5-turbo']
+
+class PromptBudgeter:
+    def __init__(self, tokenizer, system_prompt, prompt_token_target=PROMPT_TOKEN_TARGET):
+        self.tokenizer = tokenizer
+        self.system_prompt = system_prompt
+        self.prompt_token_target = prompt_token_target
+        self.lock = threading.Lock()
+        self.role_tokens = {}
+        self.system_tokens = None
+
+    def prepare(self):
+        # Tokenizes the system prompt once; later prompts only add history costs to it
+        with self.lock:
+            if self.system_tokens is None:
+                for role in ('system', 'user', 'assistant'):
+                    self.role_tokens[role] = len(self.tokenizer.encode(role))
+                self.system_tokens = self.message_cost('system', len(self.tokenizer.encode(self.system_prompt)))
+        return self.system_tokens
+
+    def message_cost(self, role, content_tokens):
+        return TOKENS_PER_MESSAGE + self.role_tokens[role] + content_tokens
+
+    def prompt_budget(self, model, max_output_tokens):
+        return min(self.prompt_token_target, context_window(model) - max_output_tokens)
+
+    def history_limits(self, model, max_output_tokens, summary_tokens=0):
+        # (content tokens, framing tokens per message) a conversation window can hold and still fit the prompt
+        # next to the system prompt and a summary of up to summary_tokens, so history leaves the prompt only
+        # by being evicted from the conversation, which is what gets it summarized. Never less than a typical
+        # question and its full answer, or every exchange would be summarized as soon as it ends
+        used = self.prepare() + TOKENS_PER_REPLY
+        if summary_tokens:
+            used += self.message_cost('system', summary_tokens)
+        overhead = max(self.message_cost(role, 0) for role in ('user', 'assistant'))
+        exchange = TYPICAL_QUESTION_TOKENS + max_output_tokens + 2 * overhead
+        return max(self.prompt_budget(model, max_output_tokens) - used, exchange), overhead
+
+    def build_messages(self, history, model, max_output_tokens, summary=None):
+        # history holds {'role', 'content', 'tokens'} dicts, oldest first. The newest one, the question being
+        # asked, is always sent as long as it fits the model's context window; the summary and older
+        # messages then fill what is left of the target
+        used = self.prepare() + TOKENS_PER_REPLY
+        selected = []
+        if history:
+            newest = history[-1]
+            used += self.message_cost(newest['role'], newest['tokens'])
+            if used > context_window(model) - max_output_tokens:
+                raise MessageTooLongError(f'{used} prompt tokens do not fit {model}')
+            selected.append({'role': newest['role'], 'content': newest['content']})
+        budget = self.prompt_budget(model, max_output_tokens)
+        if summary is not None and used + self.message_cost('system', summary['tokens']) <= budget:
+            used += self.message_cost('system', summary['tokens'])
+        else:
+            summary = None
+        for message in reversed(history[:-1]):
+            cost = self.message_cost(message['role'], message['tokens'])
+            if used + cost > budget:
+                break
+            used += cost
+            selected.append({'role': message['role'], 'content': message['content']})
+        if summary is not None:
+            selected.append({'role': 'system', 'content': summary['content']})
+        selected.append({'role': 'system', 'content': self.system_prompt})
+        selected.reverse()
+        return selected, used
+
+    def count_messages(self, messages):
+        system_tokens = self.prepare()
+        total = TOKENS_PER_REPLY
+        for message in messages:
+            if message['role'] == 'system' and message['content'] == self.system_prompt:
+                total += system_tokens
+            else:
+                total += self.message_cost(message['role'], len(self.tokenizer.encode(message['content'])))
+        return total
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from metrics import metrics
+
+RESPONSE_CACHE_TTL = 24 * 3600     # seconds
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_PATH = 'response_cache.json'     # None keeps the cache in memory only
+
+def normalize_prompt(text):
+    return re.sub(r'\s+', ' ', text.lower()).strip().rstrip('?!. ')
+
+class ResponseCache:
+    # Exact-match cache of LLM answers with a TTL and LRU eviction
+    def __init__(self, name, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_SIZE, path=RESPONSE_CACHE_PATH, persister=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.persister = persister
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> (expires at, value), least recently used first
+        metrics.register_gauge(f'{name}.size', lambda: len(self.entries))
+        if path is not None:
+            self.load()
+
+    def key(self, model, prompt, context=()):
+        material = json.dumps([model, normalize_prompt(prompt), list(context)])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                metrics.increment(f'{self.name}.misses')
+                return None
+            self.entries.move_to_end(key)
+        metrics.increment(f'{self.name}.hits')
+        return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        self.save_later()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        self.save_later()
+
+    def save_later(self):
+        if self.path is None:
+            return
+        if self.persister is not None:
+            self.persister.mark_dirty(self, self.save)
+        else:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            entries = [[key, expires, value] for key, (expires, value) in self.entries.items()]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            return
+        now = time.time()
+        for key, expires, value in entries[-self.max_entries:]:
+            if expires > now:
+                self.entries[key] = (expires, value)
@@ -0,0 +1,97 @@
+MESSAGE_LIMIT = 449     # UTF-16 code units, which is how GroupMe counts message length
+MIN_FILL = 0.5          # a preferred boundary is only used if the chunk is at least this full
+CODE_BLOCK_MARKERS = ('```', '-' * 25)  # lines starting with a raw fence or the bots' separator
+
+def utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+def window_end(text, start, limit):
+    # Largest end such that text[start:end] fits in limit UTF-16 units
+    end = min(len(text), start + limit)
+    if text[start:end].isascii():   # one UTF-16 unit per character
+        return end
+    while True:
+        excess = utf16_len(text[start:end]) - limit
+        if excess <= 0:
+            return end
+        end -= (excess + 1) // 2
+
+def find_markers(text, start, end):
+    # (start, end) of every complete marker line in text[start:end], in order. str.find skips
+    # most of the window in C, where a multiline regex would try every position
+    markers = []
+    for prefix in CODE_BLOCK_MARKERS:
+        position = start
+        while True:
+            found = text.find(prefix, position, end)
+            if found == -1:
+                break
+            line_end = text.find('\n', found, end)
+            if line_end == -1:
+                break
+            if found == 0 or text[found - 1] == '\n':
+                markers.append((found, line_end + 1))
+            position = line_end + 1
+    markers.sort()
+    return markers
+
+def next_cut(text, start, limit=MESSAGE_LIMIT, in_block=False):
+    # Returns (index where the chunk starting at start should end, whether that index is inside a code block).
+    # Looks only at the next limit characters, and prefers the edges of code blocks and blank lines, then line
+    # ends, then sentence ends, then spaces, as long as the chunk stays at least MIN_FILL full
+    end = window_end(text, start, limit)
+    if end == len(text):
+        return end, in_block
+    markers = find_markers(text, start, end)
+    block_cuts = []
+    state = in_block
+    for marker_start, marker_end in markers:
+        # cut before an opening marker or after a closing one, never between a marker and its code
+        block_cuts.append(marker_end if state else marker_start)
+        state = not state
+
+    def block_state(cut):
+        for index, (_, marker_end) in enumerate(markers):
+            if marker_end > cut:
+                return in_block ^ (index % 2 == 1)
+        return state
+
+    def boundaries(lowest):
+        # The last cut of each kind at or after lowest, best kind first, -1 where there is none
+        blank = text.rfind('\n\n', lowest, end)
+        yield max(block_cuts + [blank + 1] if blank != -1 and not block_state(blank + 1) else block_cuts, default=-1)
+        line = text.rfind('\n', lowest, end)
+        yield line + 1 if line != -1 else -1
+        sentence = max(text.rfind('. ', lowest, end), text.rfind('? ', lowest, end), text.rfind('! ', lowest, end))
+        yield sentence + 2 if sentence != -1 else -1
+        space = text.rfind(' ', lowest, end)
+        yield space + 1 if space != -1 else -1
+
+    # A cut that fills MIN_FILL of the chunk can only be found in the back of the window, so only that part
+    # is searched, and a kind of boundary is only searched if the better ones failed
+    min_fill = limit * MIN_FILL
+    for cut in boundaries(max(start, int(start + min_fill) - 2)):
+        if cut > start and cut - start >= min_fill:
+            return cut, block_state(cut)
+    cut = max(boundaries(start))
+    if cut <= start:
+        cut = max(end, start + 1)
+    return cut, block_state(cut)
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    # Linear in len(text): each chunk looks at one window of text and nothing is re-sliced
+    if window_end(text, 0, limit) == len(text):     # most answers fit in one message
+        chunk = text.rstrip()
+        return [chunk] if chunk else []
+    chunks = []
+    start = 0
+    in_block = False
+    while start < len(text):
+        cut, in_block = next_cut(text, start, limit, in_block)
+        chunk = text[start:cut].rstrip()
+        if chunk:
+            chunks.append(chunk)
+        start = cut
+        while start < len(text) and text[start] == '\n':
+            start += 1
+    return chunks
@@ -0,0 +1,203 @@
+from collections import OrderedDict, deque
+import os
+import re
+import threading
+
+from persistence import JsonFileBackend, JournalBackend
+from storage import SqliteBackend, SqliteStore, owner_key
+
+HISTORY_TOKEN_LIMIT = 2000
+CONVERSATION_DIR = 'conversations'
+CONVERSATION_CACHE_SIZE = 256   # conversations kept in memory, the rest live on disk
+CONVERSATION_BACKEND = 'journal'    # 'journal' appends JSONL records, 'json' rewrites the whole file, 'sqlite' uses the shared database
+
+class Conversation:
+    def __init__(self, tokenizer, backend, persister=None, on_evict=None, key=None, history_limits=None):
+        self.tokenizer = tokenizer
+        self.key = key      # (group_id, user_id) when the conversation comes from a ConversationStore
+        self.backend = backend
+        self.persister = persister
+        self.on_evict = on_evict    # called with the messages that fell out of the token window
+        self.history_token_limit = HISTORY_TOKEN_LIMIT
+        self.message_overhead = 0   # framing tokens each message adds in a prompt
+        self.history_limits = history_limits    # returns (history_token_limit, message_overhead), called on the first add
+        self.lock = threading.RLock()
+        self.users_lock = threading.Lock()
+        self.users = 0      # jobs and summaries holding the conversation, the store only evicts it at zero
+        self.conversation_history = deque()
+        self.token_total = 0
+        self.generation = 0     # bumped by clear() so late summaries of old messages are dropped
+        self.closed = False
+        for message in self.load_conversation():
+            self.append_message(message['role'], message['content'], message.get('tokens'))
+        self.summary = self.backend.load_summary()
+
+    def save_conversation(self):
+        if self.persister is not None:
+            self.persister.mark_dirty(self, self.flush)
+        else:
+            self.backend.commit(self)
+
+    def flush(self):
+        with self.lock:
+            if not self.closed:     # a flush already under way when the store closed us
+                self.backend.commit(self)
+
+    def load_conversation(self):
+        return self.backend.load()
+
+    def add_message_to_history(self, role, content, tokens=None):
+        with self.lock:
+            self.backend.append(self.append_message(role, content, tokens))
+            evicted = self.evict_to_limit()
+            if evicted:
+                self.backend.evict(len(evicted))
+            self.save_conversation()
+            generation = self.generation
+        if evicted and self.on_evict is not None:
+            self.on_evict(self, evicted, generation)
+
+    def append_message(self, role, content, tokens=None):
+        if tokens is None:
+            tokens = len(self.tokenizer.encode(content))    # counted once, when the message is added
+        message = {'role': role, 'content': content, 'tokens': tokens}
+        self.conversation_history.append(message)
+        self.token_total += tokens
+        return message
+
+    def evict_to_limit(self):
+        if self.history_limits is not None:     # deferred until messages are counted, which needs the tokenizer anyway
+            self.history_token_limit, self.message_overhead = self.history_limits()
+            self.history_limits = None
+        # The message just added always stays, however long, so a question is never summarized before it is asked
+        evicted = []
+        while (self.token_total + self.message_overhead * len(self.conversation_history) > self.history_token_limit
+               and len(self.conversation_history) > 1):
+            message = self.conversation_history.popleft()
+            self.token_total -= message['tokens']
+            evicted.append(message)
+        return evicted
+
+    def set_summary(self, content, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.summary = {'content': content, 'tokens': len(self.tokenizer.encode(content))}
+            self.backend.set_summary(self.summary)
+            self.save_conversation()
+
+    def clear(self):
+        with self.lock:
+            self.conversation_history.clear()
+            self.token_total = 0
+            self.summary = None
+            self.generation += 1
+            self.backend.clear()
+            self.save_conversation()
+
+    def hold(self):
+        with self.users_lock:
+            self.users += 1
+
+    def release(self):
+        with self.users_lock:
+            self.users -= 1
+
+    def close(self):
+        with self.lock:
+            if self.persister is not None:
+                self.persister.discard(self)    # the writer must not reopen the file behind a reloaded copy
+                self.backend.commit(self, closing=True)
+            self.closed = True
+            self.backend.close()
+
+    def messages(self):
+        with self.lock:
+            return [{'role': m['role'], 'content': m['content']} for m in self.conversation_history]
+
+    def last_content(self, role):
+        with self.lock:
+            for message in reversed(self.conversation_history):
+                if message['role'] == role:
+                    return message['content']
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.conversation_history)
+
+    def count_tokens(self):
+        return self.token_total
+
+    def recount_tokens(self):
+        # Full re-encode, kept to verify the running total
+        return sum(len(self.tokenizer.encode(m['content'])) for m in self.conversation_history)
+
+class ConversationStore:
+    def __init__(self, tokenizer, directory=CONVERSATION_DIR, max_conversations=CONVERSATION_CACHE_SIZE,
+                 backend=CONVERSATION_BACKEND, storage=None, persister=None, on_evict=None, history_limits=None):
+        self.tokenizer = tokenizer
+        self.history_limits = history_limits
+        self.persister = persister
+        self.on_evict = on_evict
+        self.directory = directory
+        self.backend = backend
+        if backend == 'sqlite' and storage is None:
+            storage = SqliteStore()
+        self.storage = storage
+        self.max_conversations = max_conversations
+        self.conversations = OrderedDict()
+        self.closing = {}   # key -> event set once the evicted conversation is closed
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, group_id, user_id, hold=False):
+        # With hold, the caller must release() the conversation when done; until then it is never evicted
+        key = owner_key(group_id, user_id)
+        while True:
+            with self.lock:
+                closing = self.closing.get(key)
+                if closing is None:
+                    conversation = self.conversations.get(key)
+                    if conversation is not None:
+                        self.conversations.move_to_end(key)
+                    else:
+                        conversation = Conversation(self.tokenizer, self.backend_for(key), self.persister, self.on_evict, key,
+                                                    self.history_limits)     # loaded lazily from disk
+                        self.conversations[key] = conversation
+                    if hold:
+                        conversation.hold()
+                    evicted = self.evict_idle()
+                    break
+            closing.wait()      # reloading before the evicted copy is flushed would miss its last writes
+        for evicted_key, evicted_conversation in evicted:
+            try:
+                evicted_conversation.close()    # outside the lock, closing flushes to disk
+            finally:
+                with self.lock:
+                    self.closing.pop(evicted_key).set()
+        return conversation
+
+    def evict_idle(self):
+        # Called with the lock held. Picks least recently used conversations that nobody holds;
+        # they are closed once the lock is released
+        evicted = []
+        for key, conversation in list(self.conversations.items()):
+            if len(self.conversations) <= self.max_conversations:
+                break
+            if conversation.users == 0:
+                del self.conversations[key]
+                self.closing[key] = threading.Event()
+                evicted.append((key, conversation))
+        return evicted
+
+    def backend_for(self, key):
+        name = '_'.join(re.sub(r'[^A-Za-z0-9-]', '', part) or 'none' for part in key)
+        if self.backend == 'sqlite':
+            return SqliteBackend(self.storage, name)
+        if self.backend == 'journal':
+            return JournalBackend(os.path.join(self.directory, f'{name}.jsonl'))
+        return JsonFileBackend(os.path.join(self.directory, f'{name}.json'))
+
+    def __len__(self):
+        return len(self.conversations)
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+import threading
+import time
+
+from metrics import metrics
+
+SEEN_TTL = 600              # seconds a message id is remembered; GroupMe redeliveries arrive well within this
+SEEN_MAX_ENTRIES = 10000
+
+class SeenSet:
+    # Bounded set of recently seen keys that forgets them after ttl seconds
+    def __init__(self, name, ttl=SEEN_TTL, max_entries=SEEN_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> time first seen, oldest first
+        metrics.register_gauge(f'{name}.size', lambda: len(self.entries))
+
+    def add(self, key):
+        # Returns False if key was already seen within ttl
+        now = time.monotonic()
+        with self.lock:
+            while self.entries:
+                oldest, seen_at = next(iter(self.entries.items()))
+                if now - seen_at < self.ttl and len(self.entries) < self.max_entries:
+                    break
+                del self.entries[oldest]
+            if key in self.entries:
+                return False
+            self.entries[key] = now
+            return True
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+def accept_webhook(data, seen):
+    # Checked before any parsing: posts by bots (ours included) are never commands,
+    # and a message id that was already handled is a redelivery
+    if data.get('sender_type') == 'bot':
+        metrics.increment(f'{seen.name}.bot_messages')
+        return False
+    message_id = data.get('id')
+    if message_id is not None and not seen.add(message_id):
+        metrics.increment(f'{seen.name}.duplicates')
+        return False
+    return True
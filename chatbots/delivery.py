@@ -0,0 +1,148 @@
+from collections import deque
+import atexit
+import random
+import threading
+import time
+import traceback
+
+import requests
+
+from metrics import metrics
+
+DELIVERY_RETRIES = 4
+DELIVERY_BACKOFF_BASE = 0.5     # seconds, doubled on every retry
+DELIVERY_BACKOFF_MAX = 8.0
+DELIVERY_MIN_INTERVAL = 0.3     # seconds between posts to one group, GroupMe throttles bots that post faster
+DELIVERY_QUEUE_SIZE = 200       # messages waiting per group
+DELIVERY_IDLE_TIMEOUT = 60      # seconds a group's sender waits for work before it exits
+
+class Outbox:
+    # One sender thread per group, so messages arrive in the order they were queued and a slow group
+    # doesn't hold up the others
+    def __init__(self, name, send, min_interval=DELIVERY_MIN_INTERVAL, retries=DELIVERY_RETRIES,
+                 maxsize=DELIVERY_QUEUE_SIZE, idle_timeout=DELIVERY_IDLE_TIMEOUT):
+        self.name = name
+        self.send = send    # posts one message and returns the response
+        self.min_interval = min_interval
+        self.retries = retries
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.condition = threading.Condition()
+        self.queues = {}    # group_id -> deque of (enqueued, text)
+        self.senders = {}   # group_id -> thread
+        self.sending = 0
+        metrics.register_gauge(f'{name}.depth', self.depth)
+        metrics.register_gauge(f'{name}.senders', lambda: len(self.senders))
+        atexit.register(self.drain)
+
+    def enqueue(self, group_id, text):
+        with self.condition:
+            queue = self.queues.setdefault(group_id, deque())
+            if len(queue) >= self.maxsize:
+                metrics.increment(f'{self.name}.dropped')
+                return False
+            queue.append((time.monotonic(), text))
+            sender = self.senders.get(group_id)
+            if sender is None or not sender.is_alive():   # a forked worker inherits dead threads
+                sender = threading.Thread(target=self.run, args=(group_id,), name=f'{self.name}-{group_id}', daemon=True)
+                self.senders[group_id] = sender
+                sender.start()
+            self.condition.notify_all()
+        return True
+
+    def run(self, group_id):
+        last_sent = 0
+        while True:
+            with self.condition:
+                queue = self.queues[group_id]
+                deadline = time.monotonic() + self.idle_timeout
+                while not queue:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        del self.queues[group_id]
+                        del self.senders[group_id]
+                        return
+                    self.condition.wait(remaining)
+                enqueued, text = queue.popleft()
+                self.sending += 1
+            try:
+                time.sleep(max(0, last_sent + self.min_interval - time.monotonic()))
+                if self.deliver(text):
+                    metrics.increment(f'{self.name}.delivered')
+                    metrics.observe(f'{self.name}.latency', time.monotonic() - enqueued)
+                else:
+                    metrics.increment(f'{self.name}.failed')
+            except Exception:
+                traceback.print_exc()
+                metrics.increment(f'{self.name}.failed')
+            finally:
+                last_sent = time.monotonic()
+                with self.condition:
+                    self.sending -= 1
+                    self.condition.notify_all()
+
+    def deliver(self, text):
+        # Retries connection errors, 429 and 5xx with jittered backoff; other 4xx won't succeed on a retry
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.increment(f'{self.name}.retries')
+                time.sleep(random.uniform(0, min(DELIVERY_BACKOFF_MAX, DELIVERY_BACKOFF_BASE * 2 ** attempt)))
+            try:
+                response = self.send(text)
+            except requests.RequestException:
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                continue
+            return response.status_code < 400
+        return False
+
+    def depth(self):
+        with self.condition:
+            return sum(len(queue) for queue in self.queues.values()) + self.sending
+
+    def drain(self, timeout=5):
+        # Waits for everything queued so far to be posted, used at exit and in tests
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while any(self.queues.values()) or self.sending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+class DelayedNotice:
+    # Posts a "still working" message only if the work inside the with block takes longer than delay
+    def __init__(self, name, post, delay):
+        self.name = name
+        self.post = post
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.done = False
+        self.timer = None
+
+    def __enter__(self):
+        self.timer = threading.Timer(self.delay, self.fire)
+        self.timer.daemon = True
+        self.timer.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cancel()
+
+    def fire(self):
+        # Posting under the lock means that once cancel returns, the notice is either queued or never will be
+        with self.lock:
+            if self.done:
+                return
+            self.done = True
+            self.post()
+        metrics.increment(f'{self.name}.sent')
+
+    def cancel(self):
+        with self.lock:
+            if self.done:
+                return
+            self.done = True
+        self.timer.cancel()
+        metrics.increment(f'{self.name}.suppressed')
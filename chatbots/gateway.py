@@ -0,0 +1,70 @@
+import startup  # noqa: F401, imported first so the start time is taken before the imports below
+
+import time
+
+from flask import Flask, request
+
+from ai_chatbot import AIBOT_NAME, AiBot
+from config import AI_CHATBOTID, OPENAI_API_KEY, PY_CHATBOTID
+from metrics import metrics
+from py_chatbot import PYBOT_NAME, PyBot
+from storage import SqliteStore
+
+GATEWAY_PORT = 5000
+
+class Gateway:
+    # Both bots behind one server. They share the process's HTTP pools and metrics, and create_gateway
+    # gives them one SQLite store, which is how !why finds PyBot's last execution
+    def __init__(self, ai_bot, py_bot):
+        self.ai_bot = ai_bot
+        self.py_bot = py_bot
+        self.bots_by_id = {AI_CHATBOTID: ai_bot, PY_CHATBOTID: py_bot}
+        self.app = Flask(__name__)
+        self.app.route('/', methods=['POST'])(self.webhook)
+        self.app.add_url_rule('/ai', 'ai', ai_bot.webhook, methods=['POST'])
+        self.app.add_url_rule('/py', 'py', py_bot.webhook, methods=['POST'])
+        self.app.route('/metrics', methods=['GET'])(self.metrics_report)
+        self.app.after_request(self.after_request)
+
+    def webhook(self):
+        # For a callback URL shared by both bots: ?bot_id=... picks one, otherwise the @ai / @py mention does
+        bot = self.bots_by_id.get(request.args.get('bot_id'))
+        if bot is None:
+            data = request.get_json(silent=True)
+            text = ((data or {}).get('text') or '').strip()     # images and system events carry no text
+            if text.startswith(AIBOT_NAME):
+                bot = self.ai_bot
+            elif text.startswith(PYBOT_NAME):
+                bot = self.py_bot
+            else:
+                metrics.increment('gateway.ignored')
+                return "ok", 200
+        return bot.webhook()
+
+    def after_request(self, response):
+        if request.method == 'POST':
+            self.ai_bot.mark_ready()    # cold start ends with the first webhook for either bot
+        return response
+
+    def metrics_report(self):
+        return metrics.snapshot()
+
+    def prewarm_connections(self):
+        self.ai_bot.prewarm_connections()   # the GroupMe pool is shared, so this warms it for PyBot too
+
+    def drain(self, timeout):
+        # One deadline for both bots; PyBot keeps posting while the AI bot is waited on
+        deadline = time.monotonic() + timeout
+        self.ai_bot.drain(timeout)
+        self.py_bot.drain(max(0, deadline - time.monotonic()))
+
+    def run(self, host='0.0.0.0', port=GATEWAY_PORT):
+        self.prewarm_connections()
+        self.app.run(host=host, port=port)
+
+def create_gateway():
+    storage = SqliteStore()
+    return Gateway(AiBot(OPENAI_API_KEY, storage=storage), PyBot(PY_CHATBOTID, storage=storage))
+
+if __name__ == "__main__":
+    create_gateway().run()
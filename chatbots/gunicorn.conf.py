@@ -0,0 +1,31 @@
+import os
+
+# gunicorn -c chatbots/gunicorn.conf.py wsgi:app, with LBATB_BOT=py for the Python bot or gateway for both
+BOT = os.environ.get('LBATB_BOT', 'ai')
+PORTS = {'ai': 5080, 'py': 5020, 'gateway': 5000}
+
+pythonpath = os.path.dirname(os.path.abspath(__file__))   # data files stay relative to the working directory
+bind = os.environ.get('LBATB_BIND', f'0.0.0.0:{PORTS[BOT]}')
+preload_app = True      # the bot, tokenizer and openai are loaded once in the master, before the fork
+worker_class = 'gthread'
+# Must stay at 1. Conversations are cached per process, the response cache, paraphrase index and
+# rate-limit buckets are JSON files each process rewrites whole (the last writer wins), and every
+# process would enforce the global rate limits on its own. Scale with threads instead
+workers = 1
+# The AI webhook only queues work, so a few threads absorb bursts. PyBot runs one snippet at a time
+# whatever the thread count
+threads = int(os.environ.get('LBATB_THREADS', 1 if BOT == 'py' else 8))
+graceful_timeout = 75   # a worker that is shut down or reloaded finishes its queued answers first
+# The worker sends no heartbeat while worker_exit drains, and the master kills a worker silent for
+# longer than timeout, so it must outlast the drain or reloads would cut it off
+timeout = graceful_timeout + 5
+keepalive = 5
+
+def post_fork(server, worker):
+    # Sockets are opened per worker, never in the master
+    from wsgi import bot
+    bot.prewarm_connections()
+
+def worker_exit(server, worker):
+    from wsgi import bot
+    bot.drain(graceful_timeout - 10)
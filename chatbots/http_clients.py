@@ -0,0 +1,68 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+GROUPME_POST_URL = 'https://api.groupme.com/v3/bots/post'
+OPENAI_API_URL = 'https://api.openai.com/v1'
+HTTP_POOL_CONNECTIONS = 4       # hosts with a cached connection pool
+HTTP_POOL_MAXSIZE = 16          # keep-alive connections per host
+HTTP_TIMEOUT = 10               # seconds, for GroupMe calls
+
+lock = threading.Lock()
+sessions = {}   # name -> (pid that created it, session)
+
+class SharedSession(requests.Session):
+    # Shared by every thread for the life of the process. openai 0.27 caches the session per thread and
+    # closes it every 180 seconds, which would drop the whole pool for all threads
+    def close(self):
+        pass
+
+def session(name):
+    # One keep-alive session per endpoint and process; a forked worker must not share its parent's sockets
+    with lock:
+        entry = sessions.get(name)
+        if entry is None or entry[0] != os.getpid():
+            client = SharedSession()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+            client.mount('https://', adapter)
+            client.mount('http://', adapter)
+            entry = sessions[name] = (os.getpid(), client)
+            metrics.register_gauge(f'http.{name}.connections', lambda: pool_stats(name)[0])
+            metrics.register_gauge(f'http.{name}.requests', lambda: pool_stats(name)[1])
+        return entry[1]
+
+def pool_stats(name):
+    # (connections opened, requests sent); the difference is the number of reused connections
+    entry = sessions.get(name)
+    if entry is None:
+        return 0, 0
+    connections = requests_sent = 0
+    for adapter in set(entry[1].adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+    return connections, requests_sent
+
+def prewarm(name, url):
+    # Opens a connection at startup so the first real request skips the TCP and TLS handshake
+    try:
+        session(name).head(url, timeout=HTTP_TIMEOUT)
+    except requests.RequestException:
+        metrics.increment(f'http.{name}.prewarm_errors')
+
+def groupme():
+    return session('groupme')
+
+def use_for_openai(openai, aiosession=None):
+    # openai 0.27 calls requestssession once per thread and keeps the result, so every thread ends up on the
+    # same pool. Its aiohttp session is a context variable, so async callers pass theirs in each request's task
+    openai.requestssession = lambda: session('openai')
+    if aiosession is not None:
+        openai.aiosession.set(aiosession)
@@ -0,0 +1,102 @@
+from collections import deque
+import threading
+import time
+import traceback
+
+from metrics import metrics
+
+JOB_WORKERS = 6
+JOB_QUEUE_SIZE = 100    # per lane
+SCHEDULER_LANES = {
+    # weight sets the share of free workers a lane gets, concurrency caps how many run at once
+    'gpt-3.5': {'weight': 4, 'concurrency': 4},
+    'why': {'weight': 2, 'concurrency': 2},
+    'gpt-4': {'weight': 1, 'concurrency': 1},
+}
+
+class Lane:
+    def __init__(self, name, weight, concurrency, maxsize):
+        self.name = name
+        self.weight = weight
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.jobs = deque()
+        self.running = 0
+        self.credit = 0     # smooth weighted round-robin state
+
+class Scheduler:
+    # Worker pool that serves several bounded lanes by weight, with a concurrency cap per lane
+    def __init__(self, name, lanes=SCHEDULER_LANES, workers=JOB_WORKERS, maxsize=JOB_QUEUE_SIZE):
+        self.name = name
+        self.workers = workers
+        self.lanes = {lane: Lane(lane, config['weight'], config['concurrency'], maxsize) for lane, config in lanes.items()}
+        self.condition = threading.Condition()
+        self.threads = []
+        for lane in self.lanes.values():
+            metrics.register_gauge(f'{name}.{lane.name}.depth', lambda lane=lane: len(lane.jobs))
+            metrics.register_gauge(f'{name}.{lane.name}.running', lambda lane=lane: lane.running)
+
+    def submit(self, lane_name, job, *args):
+        self.ensure_started()
+        lane = self.lanes[lane_name]
+        with self.condition:
+            if len(lane.jobs) >= lane.maxsize:
+                metrics.increment(f'{self.name}.{lane_name}.rejected')
+                return False
+            lane.jobs.append((time.monotonic(), job, args))
+            self.condition.notify()
+        return True
+
+    def ensure_started(self):
+        # Started lazily so a forked worker gets its own threads
+        with self.condition:
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.run, name=f'{self.name}-{len(self.threads)}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def drain(self, timeout):
+        # Waits for queued and running jobs to finish, so a worker being shut down doesn't drop answers
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while any(lane.jobs or lane.running for lane in self.lanes.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def next_job(self):
+        # Called with the condition held
+        ready = [lane for lane in self.lanes.values() if lane.jobs and lane.running < lane.concurrency]
+        if not ready:
+            return None
+        total = sum(lane.weight for lane in ready)
+        for lane in ready:
+            lane.credit += lane.weight
+        lane = max(ready, key=lambda lane: lane.credit)
+        lane.credit -= total
+        lane.running += 1
+        return lane, lane.jobs.popleft()
+
+    def run(self):
+        while True:
+            with self.condition:
+                picked = self.next_job()
+                while picked is None:
+                    self.condition.wait()
+                    picked = self.next_job()
+            lane, (enqueued, job, args) = picked
+            started = time.monotonic()
+            metrics.observe(f'{self.name}.{lane.name}.wait', started - enqueued)
+            try:
+                job(*args)
+            except Exception:
+                traceback.print_exc()
+                metrics.increment(f'{self.name}.{lane.name}.errors')
+            finally:
+                metrics.observe(f'{self.name}.{lane.name}.service', time.monotonic() - started)
+                with self.condition:
+                    lane.running -= 1
+                    self.condition.notify_all()
@@ -0,0 +1,40 @@
+import threading
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def register_gauge(self, name, read):
+        # read is called on every snapshot, for values that are cheaper to sample than to push
+        with self.lock:
+            self.gauges[name] = read
+
+    def observe(self, name, value):
+        with self.lock:
+            timing = self.timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['total'] += value
+            timing['max'] = max(timing['max'], value)
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            timings = {name: dict(timing) for name, timing in self.timings.items()}
+        gauges = {name: value() if callable(value) else value for name, value in gauges.items()}
+        for timing in timings.values():
+            timing['avg'] = timing['total'] / timing['count'] if timing['count'] else 0.0
+        return {'counters': counters, 'gauges': gauges, 'timings': timings}
+
+metrics = Metrics()
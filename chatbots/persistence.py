@@ -0,0 +1,270 @@
+from collections import OrderedDict
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+
+from metrics import metrics
+
+JOURNAL_COMPACT_THRESHOLD = 256     # journal records before a compaction is considered
+JOURNAL_FSYNC = False
+FLUSH_INTERVAL = 1.0        # seconds dirty state may wait before it is written
+FLUSH_THRESHOLD = 64        # dirty entries that trigger an early flush
+
+class JsonFileBackend:
+    # Rewrites the whole history on every commit, the original conversation.json format
+    def __init__(self, path):
+        self.path = path
+        self.summary = None
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:       # If the file doesn't exist, return an empty list
+            return []
+        if isinstance(data, list):      # written before summaries existed
+            return data
+        self.summary = data.get('summary')
+        return data['messages']
+
+    def load_summary(self):
+        return self.summary
+
+    def set_summary(self, summary):
+        pass
+
+    def append(self, message):
+        pass
+
+    def evict(self, count):
+        pass
+
+    def clear(self):
+        pass
+
+    def commit(self, conversation, closing=False):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            if conversation.summary is None:
+                json.dump(list(conversation.conversation_history), file)
+            else:
+                json.dump({'summary': conversation.summary, 'messages': list(conversation.conversation_history)}, file)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
+
+class JournalBackend:
+    # Appends one JSON line per add/evict/clear and replays them on load
+    def __init__(self, path, compact_threshold=JOURNAL_COMPACT_THRESHOLD, fsync=JOURNAL_FSYNC):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.file = None
+        self.records = 0
+        self.live = 0
+        self.summary = None
+        self.compacting = False
+        self.compactor = None   # thread running the current compaction
+        self.closed = False
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+        messages, self.summary, records, valid_length = replay(data)
+        if valid_length < len(data):    # drop a record torn by a crash mid-write
+            with open(self.path, 'r+b') as file:
+                file.truncate(valid_length)
+        self.records = records
+        self.live = len(messages)
+        return messages
+
+    def append(self, message):
+        self.write({'op': 'add', 'role': message['role'], 'content': message['content'], 'tokens': message['tokens']})
+        self.live += 1
+
+    def evict(self, count):
+        self.write({'op': 'evict', 'count': count})
+        self.live -= count
+
+    def clear(self):
+        self.write({'op': 'clear'})
+        self.live = 0
+
+    def load_summary(self):
+        return self.summary
+
+    def set_summary(self, summary):
+        self.write({'op': 'summary', 'content': summary['content'], 'tokens': summary['tokens']})
+
+    def write(self, record):
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+            self.file.write(json.dumps(record).encode('utf-8') + b'\n')
+            self.records += 1
+
+    def commit(self, conversation, closing=False):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            # A closing backend never compacts; the next instance on the same path may already be appending
+            if closing or self.closed or self.compacting or self.records <= max(self.compact_threshold, 2 * self.live):
+                return
+            self.compacting = True
+            self.compactor = threading.Thread(target=self.compact, daemon=True)
+            self.compactor.start()
+
+    def compact(self):
+        tmp_path = None
+        try:
+            with self.lock:
+                if self.file is not None:
+                    self.file.flush()
+                offset = os.path.getsize(self.path)
+            with open(self.path, 'rb') as file:
+                messages, summary, _, _ = replay(file.read(offset))
+            directory, name = os.path.split(self.path)
+            fd, tmp_path = tempfile.mkstemp(prefix=f'{name}.', suffix='.compact', dir=directory or '.')
+            with os.fdopen(fd, 'wb') as tmp:
+                if summary is not None:
+                    tmp.write(json.dumps({'op': 'summary', **summary}).encode('utf-8') + b'\n')
+                for message in messages:
+                    record = {'op': 'add', 'role': message['role'], 'content': message['content'], 'tokens': message['tokens']}
+                    tmp.write(json.dumps(record).encode('utf-8') + b'\n')
+                with self.lock:     # records appended while we were replaying go after the snapshot
+                    if self.file is not None:
+                        self.file.flush()
+                    with open(self.path, 'rb') as file:
+                        file.seek(offset)
+                        tail = file.read()
+                    tmp.write(tail)
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                    if self.file is not None:
+                        self.file.close()
+                        self.file = None
+                    os.replace(tmp_path, self.path)
+                    self.records = len(messages) + (summary is not None) + tail.count(b'\n')
+        finally:
+            self.compacting = False
+            if tmp_path is not None and os.path.exists(tmp_path):    # left behind when the compaction failed before the replace
+                os.remove(tmp_path)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            compactor = self.compactor
+        if compactor is not None:
+            compactor.join()    # outside the lock, which the compaction needs to finish
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+
+def replay(data):
+    messages = []
+    summary = None
+    records = 0
+    valid_length = 0
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b'\n'):
+            break
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        if record['op'] == 'add':
+            messages.append({'role': record['role'], 'content': record['content'], 'tokens': record.get('tokens')})
+        elif record['op'] == 'evict':
+            del messages[:record['count']]
+        elif record['op'] == 'clear':
+            messages = []
+            summary = None
+        elif record['op'] == 'summary':
+            summary = {'content': record['content'], 'tokens': record['tokens']}
+        records += 1
+        valid_length += len(line)
+    return messages, summary, records, valid_length
+
+class WriteBehindPersister:
+    # Coalesces dirty state by key and writes it from a background thread
+    def __init__(self, name, interval=FLUSH_INTERVAL, max_dirty=FLUSH_THRESHOLD):
+        self.name = name
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.dirty = OrderedDict()      # key -> (flush function, time it first became dirty)
+        self.thread = None
+        self.stopped = False
+        metrics.register_gauge(f'{name}.queue_depth', self.queue_depth)
+        metrics.register_gauge(f'{name}.flush_lag', self.flush_lag)
+        atexit.register(self.stop)
+
+    def mark_dirty(self, key, flush):
+        with self.lock:
+            if key in self.dirty:
+                self.dirty[key] = (flush, self.dirty[key][1])
+            else:
+                self.dirty[key] = (flush, time.monotonic())
+            if len(self.dirty) >= self.max_dirty:
+                self.wakeup.set()
+            self.ensure_started()
+
+    def discard(self, key):
+        with self.lock:
+            self.dirty.pop(key, None)
+
+    def ensure_started(self):
+        # Started lazily so a forked worker gets its own thread
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name=f'{self.name}-writer', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.dirty = self.dirty, OrderedDict()
+        if not pending:
+            return
+        start = time.monotonic()
+        for key, (flush, dirty_since) in pending.items():
+            try:
+                flush()
+            except Exception:
+                traceback.print_exc()
+                with self.lock:     # keep it dirty so the next flush retries it
+                    self.dirty.setdefault(key, (flush, dirty_since))
+        metrics.observe(f'{self.name}.flush', time.monotonic() - start)
+
+    def queue_depth(self):
+        return len(self.dirty)
+
+    def flush_lag(self):
+        with self.lock:
+            if not self.dirty:
+                return 0.0
+            return time.monotonic() - next(iter(self.dirty.values()))[1]
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.flush()
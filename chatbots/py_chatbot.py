@@ -1,15 +1,21 @@
 from enum import Enum
 import traceback
+import builtins
 import contextlib
 import io
-import json
+import threading
 
 from flask import Flask, request
-import requests
 
+from chunker import split_message
 from config import PY_CHATBOTID
+from dedup import SeenSet, accept_webhook
+from delivery import Outbox
+import http_clients
+from metrics import metrics
+from storage import SqliteStore
 
-POST_URL = 'https://api.groupme.com/v3/bots/post'
+POST_URL = http_clients.GROUPME_POST_URL
 PYBOT_NAME = "@py"
 PYBOT_USERID = "879523"
 
@@ -20,10 +26,13 @@ class CommandType(Enum):
     HELP = '!help'
 
 class PyBot:
-    def __init__(self, bot_id):
+    def __init__(self, bot_id, storage=None):
         self.bot_id = bot_id
         self.limited_locals = {}
-        self.history = []
+        self.storage = storage if storage is not None else SqliteStore()
+        self.seen = SeenSet('pybot.seen')
+        self.exec_lock = threading.Lock()   # stdout is redirected for the whole process while code runs
+        self.outbox = Outbox('pybot.outbox', self.send_message)
         self.command_handlers = {
             CommandType.PING: self.handle_ping_command,
             CommandType.CLEARVARS: self.clear_vars,
@@ -32,20 +41,24 @@ class PyBot:
         }
         self.app = Flask(__name__)
         self.app.route('/', methods=['POST'])(self.webhook)
+        self.app.route('/metrics', methods=['GET'])(self.metrics_report)
 
     def webhook(self):
         data = request.get_json()
-        self.process_message(data['user_id'], data['text'])
+        if accept_webhook(data, self.seen):
+            self.process_message(data.get('group_id'), data['user_id'], data['text'])
         return "ok", 200
+
+    def metrics_report(self):
+        return metrics.snapshot()
     
-    def process_message(self, user_id, text):   
+    def process_message(self, group_id, user_id, text):   
         if text.strip().startswith(PYBOT_NAME):
             command, args = self.parse_message(text)
             if command is None:
-                self.history.append({'role': 'user', 'content': text})  
-                self.handle_python_command(args, user_id)
+                self.handle_python_command(args, group_id, user_id)
             else:
-                self.command_handlers[command]()
+                self.command_handlers[command](group_id)
                 
     def parse_message(self, message):
         cleaned_message = self.clean_code(message)
@@ -58,14 +71,18 @@ class PyBot:
             args = cleaned_message
         return command, args
     
-    def post_message(self, text, mention=False):
-        data = {'bot_id': self.bot_id, 'text': str(text)}
-        requests.post(POST_URL, json=data)
+    def post_message(self, text, group_id=None, mention=False):
+        for chunk in split_message(str(text)):
+            self.outbox.enqueue(group_id, chunk)
+
+    def send_message(self, text):
+        data = {'bot_id': self.bot_id, 'text': text}
+        return http_clients.groupme().post(POST_URL, json=data, timeout=http_clients.HTTP_TIMEOUT)
 
     def execute_code(self, code):
         try:
             stdout = io.StringIO()
-            with contextlib.redirect_stdout(stdout):
+            with self.exec_lock, contextlib.redirect_stdout(stdout):
                 self.__safe_exec(code)
             output = stdout.getvalue()
             formatted_output = '-'*25 + '\n' + output + '\n' + '-'*25 if 'print' in code else output
@@ -87,7 +104,7 @@ class PyBot:
                 return __import__(name, globals, locals, fromlist, level)
             raise ImportError(f'Importing {name} is not allowed')
 
-        safe_builtins = {key: value for key, value in globals()["__builtins__"].__dict__.items()
+        safe_builtins = {key: value for key, value in builtins.__dict__.items()
                         if key not in disallowed_builtins}
         safe_builtins['__import__'] = safe_import
         try:
@@ -98,25 +115,25 @@ class PyBot:
     def clean_code(self, code):
         return code.replace(PYBOT_NAME, '').strip()
 
-    def handle_ping_command(self):
-        self.post_message('PyBot is up and running!')
+    def handle_ping_command(self, group_id):
+        self.post_message('PyBot is up and running!', group_id)
 
-    def handle_python_command(self, args, user_id):
+    def handle_python_command(self, args, group_id, user_id):
         output, formatted_output = self.execute_code(args)
         if formatted_output is not None:
-            self.history.append({'role': 'assistant', 'content': output}) 
-            self.save_chat_history()
-            self.post_message(formatted_output)
+            self.storage.record_execution(group_id, user_id, args, output, output.startswith('Traceback'))
+            self.storage.flush()    # committed right away so !why in the AI bot sees it
+            self.post_message(formatted_output, group_id)
 
-    def clear_vars(self):
+    def clear_vars(self, group_id):
         self.limited_locals.clear()
-        self.post_message('All variables have been cleared.')
+        self.post_message('All variables have been cleared.', group_id)
 
-    def list_vars(self):
+    def list_vars(self, group_id):
         vars_list = "\n".join(f"{var}: {val}" for var, val in self.limited_locals.items())
-        self.post_message(vars_list if vars_list else 'No variables.')
+        self.post_message(vars_list if vars_list else 'No variables.', group_id)
 
-    def help(self):
+    def help(self, group_id):
         commands = [
             {'command': '!clear', 'description': 'Clears all variables.'},
             {'command': '!list', 'description': 'Lists all variables and their values.'},
@@ -125,13 +142,16 @@ class PyBot:
             {'command': '!help', 'description': 'Displays this help message.'}
         ]
         help_message = "Available commands for pybot:\n" + "\n".join(f"{command['command']}: {command['description']}" for command in commands)
-        self.post_message(help_message)
+        self.post_message(help_message, group_id)
+
+    def prewarm_connections(self):
+        http_clients.prewarm('groupme', POST_URL)
 
-    def save_chat_history(self):
-        with open('chat_history.json', 'w') as f:
-            json.dump(self.history, f)
+    def drain(self, timeout):
+        self.outbox.drain(timeout)
 
     def run(self, host='0.0.0.0', port=5020):
+        self.prewarm_connections()
         self.app.run(host=host, port=port, debug=True)
 
 if __name__ == "__main__":
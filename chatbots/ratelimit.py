@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+
+from metrics import metrics
+
+# requests and tokens (prompt + completion) allowed per hour, at each level
+RATE_LIMITS = {
+    'gpt-4': {'global': (30, 60000), 'group': (20, 40000), 'user': (10, 20000)},
+    'gpt-3.5-turbo': {'global': (1200, 1200000), 'group': (600, 600000), 'user': (60, 60000)},
+}
+RATE_LIMIT_LEVELS = ('global', 'group', 'user')
+RATE_LIMIT_WINDOW = 3600    # seconds for a bucket to refill completely
+RATE_LIMIT_PATH = 'rate_limits.json'    # None keeps bucket levels in memory only
+
+def model_family(model):
+    return 'gpt-4' if model.startswith('gpt-4') else 'gpt-3.5-turbo'
+
+class TokenBucket:
+    def __init__(self, capacity, refill_rate, level=None, updated=None):
+        self.capacity = capacity
+        self.refill_rate = refill_rate      # per second
+        self.level = capacity if level is None else level
+        self.updated = time.time() if updated is None else updated
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        if self.level >= amount:
+            return 0.0
+        return (min(amount, self.capacity) - self.level) / self.refill_rate
+
+    def full(self):
+        return self.level >= self.capacity
+
+class RateLimiter:
+    # Token buckets for requests and tokens at global, per-group and per-user level
+    def __init__(self, name, limits=RATE_LIMITS, window=RATE_LIMIT_WINDOW, path=RATE_LIMIT_PATH, persister=None):
+        self.name = name
+        self.limits = limits
+        self.window = window
+        self.path = path
+        self.persister = persister
+        self.lock = threading.Lock()
+        self.buckets = {}
+        if path is not None:
+            self.load()
+
+    def bucket_keys(self, family, group_id, user_id, levels=RATE_LIMIT_LEVELS):
+        ids = {'global': '', 'group': str(group_id), 'user': f'{group_id}/{user_id}'}
+        return [(family, level, ids[level]) for level in levels]
+
+    def bucket(self, key, kind):
+        bucket = self.buckets.get((key, kind))
+        if bucket is None:
+            requests, tokens = self.limits[key[0]][key[1]]
+            capacity = requests if kind == 'requests' else tokens
+            bucket = self.buckets[(key, kind)] = TokenBucket(capacity, capacity / self.window)
+        return bucket
+
+    def acquire(self, model, group_id, user_id, tokens, levels=RATE_LIMIT_LEVELS):
+        # Takes one request and the estimated tokens from every level, or nothing if any level is short.
+        # Returns (allowed, seconds until the request would be allowed).
+        # Work nobody asked for, like summaries, passes levels=('global',).
+        family = model_family(model)
+        if family not in self.limits:
+            return True, 0.0
+        now = time.time()
+        with self.lock:
+            wanted = []
+            for key in self.bucket_keys(family, group_id, user_id, levels):
+                wanted.append((self.bucket(key, 'requests'), 1))
+                wanted.append((self.bucket(key, 'tokens'), tokens))
+            for bucket, amount in wanted:
+                bucket.refill(now)
+            retry_after = max(bucket.wait_time(amount) for bucket, amount in wanted)
+            if retry_after == 0:
+                for bucket, amount in wanted:
+                    bucket.level -= amount
+        metrics.increment(f'{self.name}.{family}.allowed' if retry_after == 0 else f'{self.name}.{family}.limited')
+        self.save_later()
+        return retry_after == 0, retry_after
+
+    def settle(self, model, group_id, user_id, reserved, used, levels=RATE_LIMIT_LEVELS):
+        # Corrects the token buckets once the real usage is known; the level may go below zero
+        family = model_family(model)
+        if family not in self.limits:
+            return
+        with self.lock:
+            for key in self.bucket_keys(family, group_id, user_id, levels):
+                bucket = self.bucket(key, 'tokens')
+                bucket.level = min(bucket.capacity, bucket.level + reserved - used)
+        self.save_later()
+
+    def refund(self, model, group_id, user_id, reserved, levels=RATE_LIMIT_LEVELS):
+        # Gives back everything acquire took for a call that failed before the model answered
+        family = model_family(model)
+        if family not in self.limits:
+            return
+        with self.lock:
+            for key in self.bucket_keys(family, group_id, user_id, levels):
+                for kind, amount in (('requests', 1), ('tokens', reserved)):
+                    bucket = self.bucket(key, kind)
+                    bucket.level = min(bucket.capacity, bucket.level + amount)
+        metrics.increment(f'{self.name}.{family}.refunded')
+        self.save_later()
+
+    def save_later(self):
+        if self.path is None:
+            return
+        if self.persister is not None:
+            self.persister.mark_dirty(self, self.save)
+        else:
+            self.save()
+
+    def save(self):
+        now = time.time()
+        with self.lock:
+            for bucket in self.buckets.values():
+                bucket.refill(now)
+            for bucket_key in [k for k, bucket in self.buckets.items() if bucket.full()]:
+                del self.buckets[bucket_key]    # a full bucket is the same as a missing one
+            state = [[list(key), kind, bucket.level, bucket.updated] for (key, kind), bucket in self.buckets.items()]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+        for key, kind, level, updated in state:
+            key = tuple(key)
+            if key[0] in self.limits:
+                bucket = self.bucket(key, kind)
+                bucket.level = level
+                bucket.updated = updated
@@ -0,0 +1,110 @@
+import asyncio
+import random
+import threading
+import time
+
+from metrics import metrics
+
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5      # seconds, doubled on every retry
+BACKOFF_MAX = 8.0
+MIN_ATTEMPT_TIME = 5.0  # seconds; with less of the deadline left, another attempt is not started
+BREAKER_FAILURE_THRESHOLD = 5   # consecutive upstream failures that open the breaker
+BREAKER_RESET_TIMEOUT = 30.0    # seconds before a single probe call is let through
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        metrics.register_gauge(f'{name}.state', lambda: self.state)
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    metrics.increment(f'{self.name}.opened')
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+def attempt_time(give_up_at, attempt_timeout):
+    left = give_up_at - time.monotonic()
+    return left if attempt_timeout is None else min(attempt_timeout, left)
+
+def call_with_retry(function, breaker, is_retryable, deadline, attempt_timeout=None, retries=MAX_RETRIES, base=BACKOFF_BASE,
+                    cap=BACKOFF_MAX, min_attempt=MIN_ATTEMPT_TIME):
+    # Retries retryable errors with full-jitter exponential backoff until retries or the deadline run out.
+    # function is called with the seconds its attempt may take, attempt_timeout cut down to what is left
+    # of the deadline, so the last attempt can't run past it. Only retryable (upstream) errors count
+    # against the breaker.
+    give_up_at = time.monotonic() + deadline
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            metrics.increment(f'{breaker.name}.rejected')
+            raise CircuitOpenError(f'{breaker.name} is open')
+        try:
+            result = function(attempt_time(give_up_at, attempt_timeout))
+        except Exception as error:
+            if not is_retryable(error):
+                breaker.record_success()    # the upstream answered, the request itself was bad
+                raise
+            breaker.record_failure()
+            delay = random.uniform(0, min(cap, base * 2 ** attempt))
+            if attempt == retries or time.monotonic() + delay + min_attempt > give_up_at:
+                raise
+            metrics.increment(f'{breaker.name}.retries')
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+async def async_call_with_retry(function, breaker, is_retryable, deadline, attempt_timeout=None, retries=MAX_RETRIES,
+                                base=BACKOFF_BASE, cap=BACKOFF_MAX, min_attempt=MIN_ATTEMPT_TIME):
+    # call_with_retry for coroutines: function returns an awaitable and the backoff doesn't block the event loop
+    give_up_at = time.monotonic() + deadline
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            metrics.increment(f'{breaker.name}.rejected')
+            raise CircuitOpenError(f'{breaker.name} is open')
+        try:
+            result = await function(attempt_time(give_up_at, attempt_timeout))
+        except Exception as error:
+            if not is_retryable(error):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            delay = random.uniform(0, min(cap, base * 2 ** attempt))
+            if attempt == retries or time.monotonic() + delay + min_attempt > give_up_at:
+                raise
+            metrics.increment(f'{breaker.name}.retries')
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
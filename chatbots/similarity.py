@@ -0,0 +1,157 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+
+from metrics import metrics
+
+SIMILARITY_THRESHOLD = 0.8      # Jaccard similarity of question terms needed to reuse an answer
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16                  # 16 bands of 4 rows: pairs at 0.8 similarity collide with probability > 0.99
+MIN_QUESTION_TERMS = 2          # shorter questions ("why?", "show me") depend on context and are never matched
+MAX_QUESTION_TERMS = 48         # longer ones, pasted code mostly, are rarely paraphrased and cost the most to sign
+SIMILAR_INDEX_SIZE = 2000
+SIMILAR_INDEX_PATH = 'similar_questions.json'
+
+STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'do', 'does', 'did', 'to', 'of', 'in', 'on', 'for',
+    'and', 'or', 'it', 'its', 'this', 'that', 'these', 'those', 'i', 'me', 'my', 'you', 'your', 'we', 'can',
+    'could', 'would', 'should', 'will', 'how', 'what', 'why', 'when', 'which', 'who', 'where', 'with', 'about',
+    'explain', 'describe', 'tell', 'show', 'give', 'please', 'pls', 'plz', 'thanks', 'hi', 'hey', 'so', 'just',
+    'some', 'any', 'mean', 'means', 'meaning', 'work', 'works', 'use', 'used', 'using', 'example', 'examples',
+}
+
+def question_terms(text):
+    words = []
+    for word in re.findall(r'[a-z0-9_+#]+', text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]    # crude plural folding: "comprehensions" -> "comprehension"
+        words.append(word)
+    terms = set(words)
+    terms.update(f'{first} {second}' for first, second in zip(words, words[1:]))
+    return frozenset(terms)
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+def context_fingerprint(context):
+    # context is the previous assistant answer, the same context the exact cache keys on
+    return hashlib.sha256(json.dumps(context).encode('utf-8')).hexdigest()[:16]
+
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class QuestionIndex:
+    # MinHash/LSH index over past questions, used to serve answers to paraphrased questions
+    def __init__(self, name, threshold=SIMILARITY_THRESHOLD, permutations=MINHASH_PERMUTATIONS, bands=LSH_BANDS,
+                 max_entries=SIMILAR_INDEX_SIZE, path=SIMILAR_INDEX_PATH, persister=None):
+        self.name = name
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        self.max_entries = max_entries
+        self.path = path
+        self.persister = persister
+        rng = random.Random(0)      # fixed seeds keep signatures stable across restarts
+        self.masks = [rng.getrandbits(64) for _ in range(permutations)]
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # id -> entry dict, oldest first
+        self.buckets = {}               # (band, band signature) -> ids
+        self.next_id = 0
+        metrics.register_gauge(f'{name}.size', lambda: len(self.entries))
+        if path is not None:
+            self.load()
+
+    def signature(self, terms):
+        # Each permutation XORs a well-mixed 64-bit term hash with its own mask, which keeps the minimum
+        # in C (map) instead of one big-integer multiply per term and permutation
+        hashes = [term_hash(term) for term in terms]
+        return [min(map(mask.__xor__, hashes)) for mask in self.masks]
+
+    def band_keys(self, signature):
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def probe(self, question, model, context=None):
+        # Terms and band keys of a question, computed once for both lookup and add.
+        # None for questions that are never indexed
+        if '\n' in question:
+            return None
+        terms = question_terms(question)
+        if not MIN_QUESTION_TERMS <= len(terms) <= MAX_QUESTION_TERMS:
+            return None
+        return {'question': question, 'model': model, 'context': context_fingerprint(context), 'terms': terms,
+                'band_keys': self.band_keys(self.signature(terms))}
+
+    def lookup(self, probe):
+        if probe is None:
+            return None
+        best, best_similarity = None, self.threshold
+        with self.lock:
+            candidates = set()
+            for band_key in probe['band_keys']:
+                candidates.update(self.buckets.get(band_key, ()))
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                if entry['model'] != probe['model'] or entry['context'] != probe['context']:
+                    continue
+                similarity = jaccard(probe['terms'], entry['terms'])
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+        metrics.increment(f'{self.name}.hits' if best else f'{self.name}.misses')
+        return best['answer'] if best else None
+
+    def add(self, probe, answer):
+        if probe is None:
+            return
+        self.insert(dict(probe, answer=answer))
+        self.save_later()
+
+    def insert(self, entry):
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = entry
+            for band_key in entry['band_keys']:
+                self.buckets.setdefault(band_key, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                old_id, old_entry = self.entries.popitem(last=False)
+                for band_key in old_entry['band_keys']:
+                    bucket = self.buckets[band_key]
+                    bucket.discard(old_id)
+                    if not bucket:
+                        del self.buckets[band_key]
+
+    def save_later(self):
+        if self.path is None:
+            return
+        if self.persister is not None:
+            self.persister.mark_dirty(self, self.save)
+        else:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            entries = [{'question': e['question'], 'model': e['model'], 'context': e['context'], 'answer': e['answer']}
+                       for e in self.entries.values()]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            return
+        for entry in entries[-self.max_entries:]:
+            if 'context' not in entry:
+                continue    # saved before entries carried their context, so they could belong to any conversation
+            probe = self.probe(entry['question'], entry['model'])
+            if probe is not None:
+                self.insert(dict(probe, context=entry['context'], answer=entry['answer']))
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+from metrics import metrics
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    # Concurrent calls with the same key wait for the first one and share its result
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function, *args):
+        # Returns (result, shared); shared is True when the result came from another caller's call
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+        if not leader:
+            metrics.increment(f'{self.name}.shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        metrics.increment(f'{self.name}.calls')
+        try:
+            call.result = function(*args)
+            return call.result, False
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+class AsyncSingleFlight:
+    # SingleFlight for coroutines running on one event loop
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}     # key -> future
+
+    async def do(self, key, function, *args):
+        call = self.calls.get(key)
+        while call is not None:
+            metrics.increment(f'{self.name}.shared')
+            try:
+                return await asyncio.shield(call), True     # cancelling a follower leaves the call running
+            except asyncio.CancelledError:
+                if not call.cancelled():
+                    raise
+            call = self.calls.get(key)  # the leader was cancelled, so the call is made again
+        metrics.increment(f'{self.name}.calls')
+        call = self.calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await function(*args)
+        except Exception as error:
+            call.set_exception(error)
+            call.exception()    # retrieved here so an unshared failure isn't logged as never retrieved
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            del self.calls[key]
+            if not call.done():     # the leader was cancelled
+                call.cancel()
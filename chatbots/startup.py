@@ -0,0 +1,4 @@
+import time
+
+# Entry points import this before anything else, so cold start covers every import after it
+PROCESS_START = time.monotonic()
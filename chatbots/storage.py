@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+import time
+
+DATABASE_PATH = 'lbatb.sqlite3'
+COMMIT_BATCH_SIZE = 32      # writes grouped into one transaction
+COMMIT_INTERVAL = 0.5       # seconds a write may wait for its group commit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation, id);
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation TEXT PRIMARY KEY,
+    token_total INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    conversation TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS executions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id TEXT,
+    user_id TEXT,
+    code TEXT NOT NULL,
+    output TEXT NOT NULL,
+    is_error INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS executions_by_user ON executions (group_id, user_id, id);
+"""
+
+def owner_key(group_id, user_id):
+    # The one form of (group_id, user_id) that conversations and executions are stored under, so a key
+    # taken from one bot's records finds the other's even when GroupMe sent no group_id
+    return str(group_id), str(user_id)
+
+class SqliteStore:
+    def __init__(self, path=DATABASE_PATH, batch_size=COMMIT_BATCH_SIZE, batch_interval=COMMIT_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.writer = None
+        self.pid = None
+        self.pending = 0
+        self.timer = None
+        self.writer_connection().executescript(SCHEMA)
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def writer_connection(self):
+        # Reopened in a forked worker, a SQLite connection must not be used by two processes
+        if self.pid != os.getpid():
+            self.writer = self.connect()
+            self.pid = os.getpid()
+            self.pending = 0
+            self.timer = None
+        return self.writer
+
+    def reader(self):
+        pid, connection = getattr(self.local, 'connection', (None, None))
+        if pid != os.getpid():
+            connection = self.connect()
+            self.local.connection = (os.getpid(), connection)
+        return connection
+
+    def write(self, sql, params=()):
+        with self.lock:
+            writer = self.writer_connection()
+            if self.pending == 0:
+                writer.execute('BEGIN IMMEDIATE')
+            cursor = writer.execute(sql, params)
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.commit_locked()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.batch_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+            return cursor
+
+    def flush(self):
+        with self.lock:
+            self.commit_locked()
+
+    def commit_locked(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        writer = self.writer_connection()    # resets pending a parent process left behind
+        if self.pending:
+            writer.execute('COMMIT')
+            self.pending = 0
+
+    def read(self, sql, params=()):
+        return self.reader().execute(sql, params).fetchall()
+
+    def add_message(self, conversation, message):
+        self.write('INSERT INTO messages (conversation, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?)',
+                   (conversation, message['role'], message['content'], message['tokens'], time.time()))
+
+    def evict_messages(self, conversation, count):
+        self.write('DELETE FROM messages WHERE id IN '
+                   '(SELECT id FROM messages WHERE conversation = ? ORDER BY id LIMIT ?)', (conversation, count))
+
+    def clear_messages(self, conversation):
+        self.write('DELETE FROM messages WHERE conversation = ?', (conversation,))
+        self.write('DELETE FROM summaries WHERE conversation = ?', (conversation,))
+
+    def set_summary(self, conversation, summary):
+        self.write('INSERT OR REPLACE INTO summaries (conversation, content, tokens) VALUES (?, ?, ?)',
+                   (conversation, summary['content'], summary['tokens']))
+
+    def load_summary(self, conversation):
+        rows = self.read('SELECT content, tokens FROM summaries WHERE conversation = ?', (conversation,))
+        return {'content': rows[0][0], 'tokens': rows[0][1]} if rows else None
+
+    def set_token_total(self, conversation, token_total):
+        self.write('INSERT INTO conversations (conversation, token_total, updated_at) VALUES (?, ?, ?) '
+                   'ON CONFLICT (conversation) DO UPDATE SET token_total = excluded.token_total, updated_at = excluded.updated_at',
+                   (conversation, token_total, time.time()))
+
+    def load_messages(self, conversation):
+        self.flush()    # our own pending writes must be visible to the reader connection
+        rows = self.read('SELECT role, content, tokens FROM messages WHERE conversation = ? ORDER BY id', (conversation,))
+        return [{'role': role, 'content': content, 'tokens': tokens} for role, content, tokens in rows]
+
+    def token_total(self, conversation):
+        rows = self.read('SELECT token_total FROM conversations WHERE conversation = ?', (conversation,))
+        return rows[0][0] if rows else 0
+
+    def record_execution(self, group_id, user_id, code, output, is_error):
+        self.write('INSERT INTO executions (group_id, user_id, code, output, is_error, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                   (*owner_key(group_id, user_id), code, output, int(is_error), time.time()))
+
+    def recent_executions(self, group_id, user_id, limit=1):
+        rows = self.read('SELECT code, output, is_error FROM executions WHERE group_id IS ? AND user_id IS ? '
+                         'ORDER BY id DESC LIMIT ?', (*owner_key(group_id, user_id), limit))
+        return [{'code': code, 'output': output, 'is_error': bool(is_error)} for code, output, is_error in reversed(rows)]
+
+    def close(self):
+        self.flush()
+        self.writer_connection().close()
+
+class SqliteBackend:
+    # Conversation backend that keeps history in the shared SqliteStore
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def load(self):
+        return self.store.load_messages(self.key)
+
+    def append(self, message):
+        self.store.add_message(self.key, message)
+
+    def evict(self, count):
+        self.store.evict_messages(self.key, count)
+
+    def clear(self):
+        self.store.clear_messages(self.key)
+
+    def load_summary(self):
+        return self.store.load_summary(self.key)
+
+    def set_summary(self, summary):
+        self.store.set_summary(self.key, summary)
+
+    def commit(self, conversation, closing=False):
+        self.store.set_token_total(self.key, conversation.token_total)
+
+    def close(self):
+        pass
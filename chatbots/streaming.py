@@ -0,0 +1,80 @@
+from chunker import MESSAGE_LIMIT, next_cut, utf16_len
+
+CODE_FENCE = '```'
+FENCE_REPLACEMENT = '-'*25
+SENTENCE_BOUNDARIES = ('. ', '? ', '! ', '\n')
+STREAM_MIN_CHUNK = 200      # after the first sentence, wait for this much text before posting again
+
+def rewrite_code_fences(deltas):
+    # Streaming version of the fence rewrite in AiBot.get_response_text: each line that starts
+    # with ``` becomes a separator, every other line is passed through as soon as it can't be a fence
+    line = ''
+    state = 'start'     # 'start' buffers the line head, 'text' passes it through, 'fence' drops it
+    leading = True
+    for delta in deltas:
+        out = []
+        for char in delta:
+            if leading and char.isspace():
+                continue
+            leading = False
+            if state == 'text':
+                out.append(char)
+                if char == '\n':
+                    state = 'start'
+            elif state == 'fence':
+                if char == '\n':
+                    out.append(FENCE_REPLACEMENT + '\n')
+                    state = 'start'
+            else:
+                line += char
+                if line == CODE_FENCE:
+                    state = 'fence'
+                    line = ''
+                elif char == '\n' or not CODE_FENCE.startswith(line):
+                    out.append(line)
+                    state = 'start' if char == '\n' else 'text'
+                    line = ''
+        if out:
+            yield ''.join(out)
+    if state == 'fence':
+        yield FENCE_REPLACEMENT
+    elif line:
+        yield line
+
+def collect(texts, parts):
+    for text in texts:
+        parts.append(text)
+        yield text
+
+def last_boundary(text, limit):
+    cut = 0
+    for boundary in SENTENCE_BOUNDARIES:
+        index = text.rfind(boundary, 0, limit)
+        if index != -1:
+            cut = max(cut, index + len(boundary))
+    return cut
+
+def sentence_chunks(texts, chunk_size=MESSAGE_LIMIT, min_chunk=STREAM_MIN_CHUNK, trailer=None):
+    # Yields a chunk at the first sentence boundary, then whenever min_chunk characters end in one,
+    # and never lets a chunk grow past chunk_size. trailer is called once the stream ends and its
+    # text is appended to the last chunk
+    buffer = ''
+    first = True
+    for text in texts:
+        buffer += text
+        while buffer:
+            if utf16_len(buffer) > chunk_size:
+                cut = next_cut(buffer, 0, chunk_size)[0]
+            elif first or len(buffer) >= min_chunk:
+                cut = last_boundary(buffer, len(buffer))
+            else:
+                cut = 0
+            if not cut:
+                break
+            chunk, buffer = buffer[:cut].rstrip(), buffer[cut:]
+            if chunk:
+                first = False
+                yield chunk
+    last = '\n\n'.join(part for part in (buffer.rstrip(), trailer() if trailer else '') if part)
+    if last:
+        yield last
@@ -0,0 +1,66 @@
+import queue
+import threading
+import time
+import traceback
+
+from metrics import metrics
+
+SUMMARY_TOKEN_LIMIT = 300
+SUMMARY_PREFIX = 'Summary of the earlier conversation: '
+SUMMARY_INSTRUCTIONS = """
+You maintain a running summary of a conversation between a programming student and their teacher.
+Fold the new messages into the current summary. Keep the questions asked, the code discussed and the answers given.
+Reply with the updated summary only, in under 200 words.
+"""
+
+class Summarizer:
+    # Folds messages evicted from a conversation into its running summary, off the request path
+    def __init__(self, complete, max_tokens=SUMMARY_TOKEN_LIMIT):
+        self.complete = complete
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        self.pending = {}       # conversation -> (generation, evicted messages not yet summarized)
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def submit(self, conversation, evicted, generation):
+        with self.lock:
+            pending_generation, messages = self.pending.get(conversation, (generation, []))
+            if pending_generation != generation:     # cleared since, the older messages are gone
+                messages = []
+            queued = conversation in self.pending
+            self.pending[conversation] = (generation, messages + evicted)
+            if not queued:
+                conversation.hold()     # kept loaded until its summary is written
+            self.ensure_started()
+        if not queued:
+            self.queue.put(conversation)
+
+    def ensure_started(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name='summarizer', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            conversation = self.queue.get()
+            with self.lock:
+                generation, evicted = self.pending.pop(conversation)
+            try:
+                self.summarize(conversation, evicted, generation)
+            except Exception:
+                traceback.print_exc()
+                metrics.increment('summarizer.errors')
+            finally:
+                conversation.release()
+
+    def summarize(self, conversation, evicted, generation):
+        start = time.monotonic()
+        previous = conversation.summary['content'][len(SUMMARY_PREFIX):] if conversation.summary else '(none)'
+        transcript = '\n'.join(f"{m['role']}: {m['content']}" for m in evicted)
+        messages = [{'role': 'system', 'content': SUMMARY_INSTRUCTIONS},
+                    {'role': 'user', 'content': f'Current summary:\n{previous}\n\nNew messages:\n{transcript}'}]
+        response = self.complete(messages, max_tokens=self.max_tokens)
+        summary = response['choices'][0]['message']['content'].strip()
+        conversation.set_summary(SUMMARY_PREFIX + summary, generation)
+        metrics.observe('summarizer.latency', time.monotonic() - start)
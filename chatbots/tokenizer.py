@@ -0,0 +1,38 @@
+import os
+import threading
+import time
+
+from metrics import metrics
+
+TOKENIZER_ENCODING = 'cl100k_base'
+TOKENIZER_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tiktoken_cache')
+
+# tiktoken reads this when it loads an encoding, so the BPE file comes from the project instead of the network
+os.environ.setdefault('TIKTOKEN_CACHE_DIR', TOKENIZER_CACHE_DIR)
+
+class LazyTokenizer:
+    def __init__(self, encoding_name=TOKENIZER_ENCODING):
+        self.encoding_name = encoding_name
+        self.encoding = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.encoding is None:
+                start = time.monotonic()
+                import tiktoken
+                self.encoding = tiktoken.get_encoding(self.encoding_name)
+                metrics.observe('tokenizer.load', time.monotonic() - start)
+        return self.encoding
+
+    def encode(self, text):
+        encoding = self.encoding or self.load()
+        return encoding.encode(text)
+
+def prewarm(encoding_name=TOKENIZER_ENCODING):
+    os.makedirs(os.environ['TIKTOKEN_CACHE_DIR'], exist_ok=True)
+    return LazyTokenizer(encoding_name).load()
+
+if __name__ == "__main__":
+    prewarm()
+    print(f"{TOKENIZER_ENCODING} cached in {os.environ['TIKTOKEN_CACHE_DIR']}")
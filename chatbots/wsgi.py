@@ -0,0 +1,24 @@
+import startup  # noqa: F401, imported first so the start time is taken before the bots are imported
+
+import os
+
+from config import OPENAI_API_KEY, PY_CHATBOTID
+
+BOT = os.environ.get('LBATB_BOT', 'ai')     # 'ai', 'py' or 'gateway'
+
+def create_bot(name=BOT):
+    if name == 'py':
+        from py_chatbot import PyBot
+        return PyBot(PY_CHATBOTID)
+    if name == 'gateway':
+        from gateway import create_gateway
+        gateway = create_gateway()
+        gateway.ai_bot.preload()
+        return gateway
+    from ai_chatbot import AiBot
+    bot = AiBot(OPENAI_API_KEY)
+    bot.preload()     # here, in the gunicorn master, so workers start warm and share these pages with it after the fork
+    return bot
+
+bot = create_bot()
+app = bot.app